@@ -0,0 +1,129 @@
+import numpy as np
+
+
+# path construction shared by the agents, subclasses provide choose_action(s) and choose_actions(S)
+class PathPolicy(object):
+    # epsilon : control exploration
+    # s为一个状态，也即将routeArgs中的 currentPosition变为节点embedding的表示，同时需要考虑 networkState
+    def get_path(self, env, epsilon=0.1):
+        # 存储最后的路径列表
+        path = []
+
+        # origin_express array index
+        origin_express = env.initial_route_args[-1]
+
+        step_mix_s = env.now_s
+        # traffic is copied once per path, every hop only rewrites the embedding
+        hop_state = env.hop_state_builder
+        hop_state.set_traffic(env.now_traffic)
+
+        # 添加第一个节点
+        path.append(origin_express)
+
+        # use for avoid repeat node
+        visited = dict()
+        visited[origin_express] = origin_express
+
+        # 最多产生 MAX_EP_STEPS 个节点的路径
+        for j in range(env.active_nodes):
+            current_position = origin_express
+            # currentPosition 的邻居节点，这个列表是节点的编号(array index)
+            neighbor_nodes = env.get_node_neighbors(current_position)
+
+            # if current_position is neighbor of dst
+            if env.is_dst_neighbor(current_position):
+                path.append(env.tracked_intent['dst_index'])
+                return path
+
+            if np.random.rand() > epsilon:  # add randomness to action selection for exploration
+                # choose best action
+                # here replace with s
+                action = self.choose_action(step_mix_s)
+
+                # 比较点action和 neighborNode节点的距离，以及neighborNode和目的节点的距离，需要折中，返回一个节点
+                origin_express = env.decode_action(action, current_position)  # compareNode函数返回具体的节点编号
+
+            else:
+                # choose random action
+                if len(neighbor_nodes) > 1:
+                    origin_express = neighbor_nodes[np.random.randint(len(neighbor_nodes))]  # 从currentPosition的邻居节点 随机选择一个
+
+            path.append(origin_express)
+
+            # repeat point return path
+            if visited.get(origin_express) is not None:
+                return path
+            else:
+                visited[origin_express] = origin_express
+
+            # change route_args current_position->origin_express embedding
+            step_mix_s = hop_state.set_embedding(env.node_embeddinged[origin_express])
+
+        return path
+
+        # 如果选择的点有环路，则环境会返回来一个reward，reward的值，应该很小，表示不想出现环路
+        # 2：如果即将加入的originExpress的所有邻居，已经都在path中，则需要在path中删除后三个，重新设置 originExpress
+
+    # get_path for K paths advanced together: one actor forward pass and one bulk decode per hop for all of them.
+    # states (K, s_dim) are the start states of the paths (several intents, or copies of env.now_s to draw
+    # several exploration candidates for one intent), starts and dsts their source and destination indexes
+    def get_paths(self, env, states, starts, dsts, epsilon=0.1, max_steps=None):
+        max_steps = env.active_nodes if max_steps is None else max_steps
+        embedding = env.state_builder.embedding_slice
+        S = np.array(states, dtype=np.float32)
+        current = np.array(starts, dtype=int)
+        dsts = np.asarray(dsts, dtype=int)
+        paths = [[start] for start in current]
+        visited = [{start} for start in current]
+        active = np.arange(len(current))
+        for j in range(max_steps):
+            # paths whose current node neighbours their destination end there
+            done = env.env_wires[current[active], dsts[active]] != -1
+            for i in active[done]:
+                paths[i].append(dsts[i])
+            active = active[~done]
+            if len(active) == 0:
+                break
+            next_nodes = current[active]
+            greedy = np.random.rand(len(active)) > epsilon
+            if greedy.any():
+                actions = self.choose_actions(S[active[greedy]])
+                next_nodes[greedy] = env.decode_actions(actions, current[active[greedy]])
+            for k in np.nonzero(~greedy)[0]:
+                neighbor_nodes = env.get_node_neighbors(current[active[k]])
+                if len(neighbor_nodes) > 1:
+                    next_nodes[k] = neighbor_nodes[np.random.randint(len(neighbor_nodes))]
+            # paths reaching a node twice end there
+            repeated = np.zeros(len(active), dtype=bool)
+            for k, (i, node) in enumerate(zip(active, next_nodes)):
+                paths[i].append(node)
+                repeated[k] = node in visited[i]
+                visited[i].add(node)
+            current[active] = next_nodes
+            active = active[~repeated]
+            S[active, embedding] = env.node_embeddinged[current[active]]
+        return paths
+
+
+# numpy forward pass of the DDPG actor (dense relu layer, dense tanh layer scaled by a_bound) for processes
+# that only act; weights are [l1 kernel, l1 bias, a kernel, a bias] in the order of the Actor trainable variables
+class NumpyActor(PathPolicy):
+    def __init__(self, s_dim, a_dim, a_bound, hidden=30):
+        self.a_bound = a_bound
+        self.weights = [np.zeros(shape, dtype=np.float32) for shape in self.shapes(s_dim, a_dim, hidden)]
+
+    @staticmethod
+    def shapes(s_dim, a_dim, hidden=30):
+        return [(s_dim, hidden), (hidden,), (hidden, a_dim), (a_dim,)]
+
+    def set_weights(self, weights):
+        for target, source in zip(self.weights, weights):
+            target[...] = source
+
+    def choose_actions(self, S):
+        w1, b1, w2, b2 = self.weights
+        net = np.maximum(np.dot(S, w1) + b1, 0.0)
+        return np.tanh(np.dot(net, w2) + b2) * self.a_bound
+
+    def choose_action(self, s):
+        return self.choose_actions(s[np.newaxis, :])[0]
@@ -0,0 +1,180 @@
+import logging
+import multiprocessing as mp
+import os
+import random
+import time
+import numpy as np
+from config import *
+from Actor import NumpyActor
+from utils import setup_client
+from OnosClient import get_client
+
+# path ids are stored in float32 rows, keep them exact
+PATH_ID_MODULO = 2 ** 24
+
+
+# ring of fixed width float32 rows (path id, s, a, r, s_) in shared memory, written by the env workers and
+# drained by the learner; rows older than capacity are overwritten when the learner falls behind
+class TransitionQueue(object):
+    def __init__(self, capacity, s_dim, a_dim, context=mp):
+        self.capacity = capacity
+        self.s_dim = s_dim
+        self.a_dim = a_dim
+        self.width = 2 * s_dim + a_dim + 2
+        self.data = context.RawArray('f', capacity * self.width)
+        self.head = context.RawValue('q', 0)
+        self.lock = context.Lock()
+        self.rows = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['rows'] = None
+        return state
+
+    def view(self):
+        if self.rows is None:
+            self.rows = np.frombuffer(self.data, dtype=np.float32).reshape(self.capacity, self.width)
+        return self.rows
+
+    # the transitions of one path: one row per action, sharing s, r and s_
+    def put(self, path_id, s, a, r, s_):
+        a = np.asarray(a).reshape(-1, self.a_dim)
+        rows = np.empty((len(a), self.width), dtype=np.float32)
+        rows[:, 0] = path_id
+        rows[:, 1:1 + self.s_dim] = s
+        rows[:, 1 + self.s_dim:1 + self.s_dim + self.a_dim] = a
+        rows[:, -self.s_dim - 1] = r
+        rows[:, -self.s_dim:] = s_
+        with self.lock:
+            indices = (self.head.value + np.arange(len(rows))) % self.capacity
+            self.view()[indices] = rows
+            self.head.value += len(rows)
+
+    # copy of the rows written after tail and the new tail
+    def get(self, tail):
+        with self.lock:
+            head = self.head.value
+            start = max(tail, head - self.capacity)
+            rows = self.view()[np.arange(start, head) % self.capacity]
+        return rows, head
+
+    # (s, a, r, s_) of each path in rows, ready for DDPG.store_batch
+    def split(self, rows):
+        if len(rows) == 0:
+            return
+        bounds = np.flatnonzero(rows[1:, 0] != rows[:-1, 0]) + 1
+        for group in np.split(rows, bounds):
+            yield group[0, 1:1 + self.s_dim], group[:, 1 + self.s_dim:1 + self.s_dim + self.a_dim], \
+                group[0, -self.s_dim - 1], group[0, -self.s_dim:]
+
+
+# actor weights published by the learner, workers copy them when the version changed
+class WeightBoard(object):
+    def __init__(self, shapes, context=mp):
+        self.shapes = shapes
+        self.sizes = [int(np.prod(shape)) for shape in shapes]
+        self.data = context.RawArray('f', sum(self.sizes))
+        self.version = context.RawValue('q', 0)
+        self.lock = context.Lock()
+
+    def publish(self, weights):
+        flat = np.concatenate([np.ravel(weight) for weight in weights])
+        with self.lock:
+            np.frombuffer(self.data, dtype=np.float32)[:] = flat
+            self.version.value += 1
+
+    # (weights, version), weights is None when version is still the latest
+    def read(self, version):
+        if self.version.value == version:
+            return None, version
+        with self.lock:
+            flat = np.array(np.frombuffer(self.data, dtype=np.float32))
+            version = self.version.value
+        weights = [part.reshape(shape) for part, shape in zip(np.split(flat, np.cumsum(self.sizes)[:-1]), self.shapes)]
+        return weights, version
+
+
+# env worker process: its own client and ONOSEnv, acting with a numpy copy of the actor in the learner's
+# embedding basis. On a shared controller each worker only tracks its own slice of the intents, otherwise
+# two workers could reroute the same intent and measure each other's reroutes; a recording worker writes
+# its own trace in its folder
+def run_worker(index, workers, folder, queue, board, steps, epsilon, backend, seed, embeddings):
+    from Environment import ONOSEnv
+    random.seed(seed)
+    np.random.seed(seed)
+    worker_folder = folder + 'worker%d/' % index
+    os.makedirs(worker_folder, exist_ok=True)
+    client = setup_client(backend, worker_folder + os.path.basename(ONOS_TRACE))
+    try:
+        intent_slice = None if backend == 'simulator' else (index, workers)
+        env = ONOSEnv(worker_folder, embeddings=embeddings, intent_slice=intent_slice)
+        try:
+            actor = NumpyActor(env.state_dim, REPESENTATTION_SIZE, 1)
+            version = 0
+            for step in range(steps):
+                weights, version = board.read(version)
+                if weights is not None:
+                    actor.set_weights(weights)
+                env.reset()
+                s = np.array(env.now_s)
+                path = actor.get_path(env, epsilon)
+                s_, r = env.step(path)
+                # every path node when the path is valid, only punish the last one otherwise
+                nodes = path if r > 0 else path[-1:]
+                queue.put((step * workers + index) % PATH_ID_MODULO, s, env.node_embeddinged[nodes], r, s_)
+        finally:
+            env.close()
+    finally:
+        # ends a recorded trace
+        client.close()
+
+
+# learner side: starts the env workers, moves their transitions into the agent replay memory, trains
+# continuously once learn_start transitions are stored and publishes the actor weights every sync_interval
+# updates; returns the number of updates once every worker is done. embeddings are the learner's node
+# embeddings, the actions stored in its replay memory are rows of them
+def train_parallel(agent, folder, s_dim, a_dim, workers, steps, learn_start, embeddings,
+                   sync_interval=WEIGHT_SYNC_INTERVAL, queue_capacity=TRANSITION_QUEUE_CAPACITY, epsilon=0.1,
+                   backend=ONOS_BACKEND):
+    # one recorded request sequence cannot answer several workers choosing their own intents and paths
+    if backend == 'replay':
+        raise ValueError("The replay backend cannot feed parallel env workers")
+    # workers sharing a controller split its intents, every slice needs at least one
+    if backend != 'simulator':
+        reply = get_client().get_json('http://%s:%d/onos/v1/intents' % (ONOS_IP, ONOS_PORT))
+        intents = len(reply['intents']) if 'intents' in reply else 0
+        if workers > intents:
+            raise ValueError("%d env workers cannot share %d intents" % (workers, intents))
+    embeddings = np.asarray(embeddings)
+    # workers must not inherit the TensorFlow session
+    context = mp.get_context('spawn')
+    queue = TransitionQueue(queue_capacity, s_dim, a_dim, context)
+    board = WeightBoard(NumpyActor.shapes(s_dim, a_dim), context)
+    board.publish(agent.actor_weights())
+    processes = [context.Process(target=run_worker, name='EnvWorker%d' % index, daemon=True,
+                                 args=(index, workers, folder, queue, board, steps, epsilon, backend,
+                                       np.random.randint(2 ** 31), embeddings))
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+    tail = 0
+    updates = 0
+    while True:
+        alive = any(process.is_alive() for process in processes)
+        rows, tail = queue.get(tail)
+        for s, a, r, s_ in queue.split(rows):
+            agent.store_batch(s, a, r, s_)
+        if agent.pointer > learn_start:
+            agent.learn()
+            updates += 1
+            if updates % sync_interval == 0:
+                board.publish(agent.actor_weights())
+        elif len(rows) == 0 and alive:
+            time.sleep(0.01)
+        if not alive and len(rows) == 0:
+            break
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            logging.error("%s exited with %s" % (process.name, process.exitcode))
+    return updates
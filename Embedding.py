@@ -0,0 +1,305 @@
+import hashlib
+import json
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+
+
+# CSR arrays (indptr, indices, weights) of a wire matrix, -1 means no link
+def wires_to_csr(wires):
+    wires = np.asarray(wires, dtype=float)
+    src, dst = np.nonzero(wires != -1)
+    indptr = np.zeros(len(wires) + 1, dtype=int)
+    np.cumsum(np.bincount(src, minlength=len(wires)), out=indptr[1:])
+    return indptr, dst, wires[src, dst]
+
+
+# weighted random walks (one row per walk) from the given start nodes, all walkers advance together
+def random_walks(indptr, indices, weights, starts, walk_length, rng):
+    walks = np.empty((len(starts), walk_length), dtype=int)
+    walks[:, 0] = starts
+    if walk_length == 1:
+        return walks
+    degree = np.diff(indptr)
+    cumulative = np.cumsum(weights)
+    # cumulative weight before each row and total weight of each row
+    offset = np.concatenate(([0.0], cumulative))[indptr[:-1]]
+    total = np.concatenate(([0.0], cumulative))[indptr[1:]] - offset
+    for t in range(1, walk_length):
+        current = walks[:, t - 1]
+        target = offset[current] + rng.random(len(current)) * total[current]
+        edge = np.searchsorted(cumulative, target, side='right')
+        # guard against float round off at the end of a row
+        edge = np.clip(edge, indptr[current], np.maximum(indptr[current + 1] - 1, indptr[current]))
+        # nodes without links keep the walker in place
+        walks[:, t] = np.where(degree[current] > 0, indices[np.minimum(edge, len(indices) - 1)], current)
+    return walks
+
+
+# symmetric skip-gram co-occurrence counts of a set of walks
+def cooccurrence(walks, nodes, window):
+    counts = np.zeros(nodes * nodes, dtype=float)
+    for distance in range(1, min(window, walks.shape[1] - 1) + 1):
+        left = walks[:, :-distance].ravel()
+        right = walks[:, distance:].ravel()
+        counts += np.bincount(left * nodes + right, minlength=nodes * nodes)
+        counts += np.bincount(right * nodes + left, minlength=nodes * nodes)
+    return counts.reshape(nodes, nodes)
+
+
+# top eigenpairs (by magnitude, or by value if largest) of a symmetric matrix, warm started from basis
+def subspace_iteration(matrix, basis, iterations, largest=False):
+    q = basis
+    for i in range(iterations):
+        q, r = np.linalg.qr(matrix.dot(q))
+    values, vectors = np.linalg.eigh(q.T.dot(matrix).dot(q))
+    order = np.argsort(-values if largest else -np.abs(values))
+    vectors = q.dot(vectors[:, order])
+    # keep the orientation of the previous basis
+    signs = np.sign(np.einsum('ij,ij->j', vectors, basis))
+    signs[signs == 0] = 1
+    return values[order], vectors * signs
+
+
+# in-process replacement of the OpenNE embedding tool working on env_wires
+class EmbeddingEngine(object):
+    # arrays of the last fit update starts from, saved next to cached embeddings
+    STATE = ('wires', 'walks', 'counts', 'basis')
+
+    def __init__(self, method=EMBEDDING_METHOD, size=REPESENTATTION_SIZE, workers=EMBEDDING_WORKERS,
+                 window=EMBEDDING_WINDOWS_SIZE, walk_length=EMBEDDING_WALK_LENGTH, num_walks=EMBEDDING_NUM_WALKS,
+                 seed=None, iterations=EMBEDDING_UPDATE_ITERATIONS):
+        self.method = method
+        self.size = size
+        self.workers = max(1, workers)
+        self.window = window
+        self.walk_length = walk_length
+        self.num_walks = num_walks
+        self.seed = seed
+        self.iterations = iterations
+        # state of the last fit, used by update
+        self.wires = None
+        self.walks = None
+        self.counts = None
+        self.basis = None
+        self.rng = np.random.default_rng(seed)
+
+    def state(self):
+        return {name: getattr(self, name) for name in self.STATE if getattr(self, name) is not None}
+
+    def set_state(self, state):
+        for name in self.STATE:
+            setattr(self, name, np.array(state[name]) if name in state else None)
+
+    # update can start from the last fit instead of fitting again
+    def can_update(self, wires):
+        return self.wires is not None and self.basis is not None and np.shape(wires) == self.wires.shape
+
+    # everything besides the topology that changes the result
+    def params(self):
+        return {'method': self.method, 'size': self.size, 'window': self.window, 'walk_length': self.walk_length,
+                'num_walks': self.num_walks, 'seed': self.seed}
+
+    def fit(self, wires):
+        if self.method in ('deepWalk', 'deepwalk'):
+            vectors = self.deep_walk(wires)
+        elif self.method in ('spectral', 'lap'):
+            vectors = self.spectral(wires)
+        else:
+            raise ValueError("Unknown embedding method: %s" % self.method)
+        self.wires = np.array(wires, dtype=float)
+        return self.normalize(vectors)
+
+    # nodes with an added, removed or re-weighted link since the last fit
+    def changed_nodes(self, wires):
+        src, dst = np.nonzero(np.asarray(wires, dtype=float) != self.wires)
+        return np.unique(np.concatenate((src, dst)))
+
+    # re-walk only the walks through nodes whose links changed and warm start the factorization
+    def update(self, wires):
+        if not self.can_update(wires):
+            return self.fit(wires)
+        changed = self.changed_nodes(wires)
+        if self.method in ('deepWalk', 'deepwalk'):
+            vectors = self.update_deep_walk(wires, changed)
+        else:
+            vectors = self.update_spectral(wires)
+        self.wires = np.array(wires, dtype=float)
+        return self.normalize(vectors)
+
+    # deepWalk as implicit matrix factorization: truncated SVD of the positive PMI of walk co-occurrences
+    def deep_walk(self, wires):
+        nodes = len(wires)
+        indptr, indices, weights = wires_to_csr(wires)
+        starts = np.tile(np.arange(nodes), self.num_walks)
+        chunks = np.array_split(starts, self.workers)
+        seeds = np.random.SeedSequence(self.seed).spawn(len(chunks))
+
+        def work(chunk, seed):
+            walks = random_walks(indptr, indices, weights, chunk, self.walk_length, np.random.default_rng(seed))
+            return walks, cooccurrence(walks, nodes, self.window)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(work, chunks, seeds))
+        self.walks = np.concatenate([walks for walks, counts in results])
+        self.counts = sum(counts for walks, counts in results)
+        return self.factorize(self.ppmi(self.counts))
+
+    def update_deep_walk(self, wires, changed):
+        nodes = len(wires)
+        affected = np.nonzero(np.isin(self.walks, changed).any(axis=1))[0]
+        if len(affected) > 0:
+            indptr, indices, weights = wires_to_csr(wires)
+            old_walks = self.walks[affected]
+            new_walks = random_walks(indptr, indices, weights, old_walks[:, 0], self.walk_length, self.rng)
+            self.counts += cooccurrence(new_walks, nodes, self.window) - cooccurrence(old_walks, nodes, self.window)
+            self.walks[affected] = new_walks
+        # the ppmi matrix is symmetric, its singular vectors are eigenvectors
+        values, self.basis = subspace_iteration(self.ppmi(self.counts), self.basis, self.iterations)
+        return self.pad(self.basis * np.sqrt(np.abs(values)))
+
+    @staticmethod
+    def ppmi(counts):
+        total = counts.sum()
+        rows = counts.sum(axis=1, keepdims=True)
+        cols = counts.sum(axis=0, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pmi = np.log(counts * total / (rows * cols))
+        pmi[~np.isfinite(pmi)] = 0.0
+        return np.maximum(pmi, 0.0)
+
+    def factorize(self, matrix):
+        u, s, vt = np.linalg.svd(matrix)
+        k = min(self.size, len(s))
+        self.basis = u[:, :k]
+        return self.pad(self.basis * np.sqrt(s[:k]))
+
+    # laplacian eigenmaps: smallest non trivial eigenvectors of the normalized laplacian
+    def spectral(self, wires):
+        values, vectors = np.linalg.eigh(self.laplacian(wires))
+        k = min(self.size, len(values) - 1)
+        # the trivial eigenvector is kept in the basis so warm starts span it
+        self.basis = vectors[:, :k + 1]
+        return self.pad(vectors[:, 1:k + 1])
+
+    # smallest eigenvalues of the laplacian are the largest of 2I - L
+    def update_spectral(self, wires):
+        laplacian = self.laplacian(wires)
+        shifted = 2 * np.eye(len(laplacian)) - laplacian
+        values, self.basis = subspace_iteration(shifted, self.basis, self.iterations, largest=True)
+        return self.pad(self.basis[:, 1:])
+
+    @staticmethod
+    def laplacian(wires):
+        wires = np.asarray(wires, dtype=float)
+        adjacency = np.where(wires != -1, wires, 0.0)
+        adjacency = (adjacency + adjacency.T) / 2
+        if adjacency.max() > 0:
+            adjacency /= adjacency.max()
+        degree = adjacency.sum(axis=1)
+        scale = np.where(degree > 0, 1.0 / np.sqrt(np.where(degree > 0, degree, 1.0)), 0.0)
+        return np.eye(len(wires)) - scale[:, np.newaxis] * adjacency * scale[np.newaxis, :]
+
+    def pad(self, vectors):
+        if vectors.shape[1] < self.size:
+            vectors = np.hstack((vectors, np.zeros((len(vectors), self.size - vectors.shape[1]))))
+        return vectors
+
+    # actions are bounded by a_bound = 1, scale uniformly so distances keep their order
+    @staticmethod
+    def normalize(vectors):
+        peak = np.abs(vectors).max()
+        return vectors / peak if peak > 0 else vectors
+
+
+STATE_SUFFIX = '.state.npz'
+
+
+# embeddings stored as .npy files named by a hash of the topology and the embedding parameters, with the
+# engine state of their fit in a .state.npz file next to them; least recently used entries are evicted
+# above max_bytes
+class EmbeddingCache(object):
+    def __init__(self, folder=EMBEDDING_CACHE_DIR, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(wires, devices, params):
+        digest = hashlib.sha1()
+        wires = np.ascontiguousarray(wires, dtype=float)
+        digest.update(str(wires.shape).encode('utf-8'))
+        digest.update(wires.tobytes())
+        digest.update('\n'.join(devices).encode('utf-8'))
+        digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key + '.npy')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            vectors = np.load(path, mmap_mode='r')
+            # mark as recently used
+            os.utime(path)
+            return vectors
+        except (IOError, ValueError):
+            return None
+
+    # engine state of the cached embeddings, None when it was not saved
+    def get_state(self, key):
+        try:
+            with np.load(os.path.join(self.folder, key + STATE_SUFFIX)) as state:
+                return dict(state)
+        except (IOError, ValueError):
+            return None
+
+    def put(self, key, vectors, state=None):
+        os.makedirs(self.folder, exist_ok=True)
+        if state:
+            # written first, a reader finding the vectors finds their state too
+            self.write(os.path.join(self.folder, key + STATE_SUFFIX), lambda file: np.savez(file, **state))
+        path = self.path(key)
+        self.write(path, lambda file: np.save(file, np.asarray(vectors, dtype=float)))
+        self.evict(keep=key)
+
+    @staticmethod
+    def write(path, save):
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp, 'wb') as file:
+            save(file)
+        os.replace(temp, path)
+
+    # an entry is the .npy and its state, aged by the .npy
+    def evict(self, keep=None):
+        entries = {}
+        for name in os.listdir(self.folder):
+            if name.endswith('.npy'):
+                key = name[:-len('.npy')]
+            elif name.endswith(STATE_SUFFIX):
+                key = name[:-len(STATE_SUFFIX)]
+            else:
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed by another run
+                continue
+            mtime, size, paths = entries.get(key, (0.0, 0, []))
+            if name.endswith('.npy'):
+                mtime = stat.st_mtime
+            entries[key] = (mtime, size + stat.st_size, paths + [path])
+        total = sum(size for mtime, size, paths in entries.values())
+        for key, (mtime, size, paths) in sorted(entries.items(), key=lambda entry: entry[1][0]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
@@ -1,13 +1,17 @@
-﻿import logging
+﻿import asyncio
+import logging
 import numpy as np
 import networkx as nx
 import os
 import json
 import random
-import time
-import matplotlib.pyplot as plt
+from collections import deque
 from config import *
-from utils import bps_to_human_string,url_quote,json_post_req,criteria_type_key_to_self_key, criteria_type_key_to_value_key, json_get_req, pretty, softmax
+from utils import bps_to_human_string,url_quote,is_stable,criteria_type_key_to_self_key, criteria_type_key_to_value_key, pretty, softmax
+from OnosClient import get_client
+from Embedding import EmbeddingEngine, EmbeddingCache
+from LoadMonitor import LoadMonitor
+from TrafficLog import TrafficLog
 
 
 def matrix_to_onos_v(matrix):
@@ -21,20 +25,75 @@ def vector_to_file(vector, file_name, action):
         return file.write(string + '\n')
 
 
+# s = route args without the current position + current node embedding + flattened traffic,
+# written in place into one preallocated buffer, callers get views of it
+class StateBuilder(object):
+    def __init__(self, route_args, embedding_size, traffic_size, dtype=np.float32):
+        route_size = len(route_args)
+        traffic_start = route_size + embedding_size
+        self.buffer = np.zeros(traffic_start + traffic_size, dtype=dtype)
+        self.route = self.buffer[:route_size]
+        self.embedding = self.buffer[route_size:traffic_start]
+        self.traffic = self.buffer[traffic_start:]
+        # where the embedding goes in a batch of states built from this buffer
+        self.embedding_slice = slice(route_size, traffic_start)
+        self.route[:] = route_args
+
+    def set_embedding(self, vector):
+        self.embedding[:] = vector
+        return self.buffer
+
+    def set_traffic(self, traffic):
+        # ravel is a view of a contiguous load matrix
+        self.traffic[:] = np.ravel(traffic)
+        return self.buffer
+
+
 DEVICES = 'Devices.txt'
 PORTS = 'Ports.txt'
 LOADS = 'Loads.txt'
 WIRES = 'Wires.txt'
 EMBEDDINGINPUT = 'EmbeddingInput.txt'
 EMBEDDINGOUTPUT = 'EmbeddingOutput.txt'
+LINK_LOG = 'LinkLoads'
 
 
 class ONOSEnv():
-    def __init__(self, folder):
+    # embeddings: node embeddings to use instead of fitting them, e.g. the learner's in an env worker
+    # intent_slice: (index, count), only track intents of that slice of the intents sorted by key, so that
+    # envs sharing one controller never reroute the same intent
+    def __init__(self, folder, client=None, embeddings=None, intent_slice=None):
         self.folder = folder
+        self.embeddings = embeddings
+        self.intent_slice = intent_slice
+        # shared keep-alive ONOS REST client
+        self.client = client if client is not None else get_client()
+        # private loop driving the async API behind the synchronous wrappers
+        self.loop = asyncio.new_event_loop()
         self.G = nx.Graph()
         self.active_nodes = 0
         self.node_embeddinged = []
+        self.embedding_engine = EmbeddingEngine()
+        # CSR adjacency of env_wires, neighbors of i are adj_indices[adj_indptr[i]:adj_indptr[i+1]]
+        self.adj_indptr = []
+        self.adj_indices = []
+        # fixed link order of the links state layout, set by the first update_links
+        self.link_src = []
+        self.link_dst = []
+        # (src device, dst device) -> index in the flattened env_loads
+        self.link_key_index = {}
+        # getLinksLoad change detection and the flat indexes of the last reply layout
+        self.links_validator = {}
+        self.links_changed = 0
+        # client time the last direct getLinksLoad poll was sent
+        self.direct_poll_time = float('-inf')
+        # (link keys, flat indexes of the known links, known mask)
+        self.reply_layout = None
+        # a load reply listed links update_links did not see or missed some it saw, refresh_topology is due
+        self.topology_changed = False
+        # embeddings and squared norms of adj_indices, same CSR layout
+        self.neighbor_embeddings = []
+        self.neighbor_sq_norms = []
         self.devices = []
         self.deviceId_to_arrayIndex = {}
         self.arrayIndex_to_deviceId = {}
@@ -44,9 +103,17 @@ class ONOSEnv():
         self.hosts = {}
         self.tracked_intent = {}
         self.initial_route_args = []
+        # reset, step and get_path states, each reused across calls
+        self.state_builder = None
+        self.next_state_builder = None
+        self.hop_state_builder = None
+        # optional background poller of link loads
+        self.monitor = None
+        # binary log of the link loads in the fixed link order
+        self.traffic_log = None
         self.set_up()
-        self.monitor_load_bool = True
-        #  self.monitor_load()
+        if MONITOR_BACKGROUND:
+            self.start_monitor()
         self.now_s = []
         self.now_traffic = []
 
@@ -58,6 +125,8 @@ class ONOSEnv():
         self.update_links()
         if len(self.env_loads) == 0:
             raise Exception("Set up links Error!")
+        if TRAFFIC_LOG:
+            self.traffic_log = TrafficLog(self.folder + LINK_LOG, len(self.link_src))
 
         self.update_host()
         if len(self.hosts) == 0:
@@ -66,16 +135,20 @@ class ONOSEnv():
         self.node_embedding()
         if len(self.node_embeddinged) == 0:
             raise Exception("Embedding Error!")
+        self.build_neighbor_blocks()
 
         self.chose_intent()
         if len(self.tracked_intent.keys()) == 0:
             raise Exception("Set up intent Error!")
             return
         self.set_up_route_args()
+        self.set_up_state()
 
-    def validate_path(self, indexs_path):
-        if indexs_path[0] != self.tracked_intent['src_index'] \
-                or indexs_path[-1] != self.tracked_intent['dst_index']:
+    # intent defaults to the tracked intent
+    def validate_path(self, indexs_path, intent=None):
+        intent = self.tracked_intent if intent is None else intent
+        if indexs_path[0] != intent['src_index'] \
+                or indexs_path[-1] != intent['dst_index']:
             return False
         # it seem to  not be necessary if i add it int get path
         visited = {}
@@ -86,14 +159,43 @@ class ONOSEnv():
                 return False
         return True
 
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
     def step(self, indexs_path):
+        return self.run(self.step_async(indexs_path))
+
+    async def step_async(self, indexs_path):
         if not self.validate_path(indexs_path):
             return self.now_s, -1.0
 
         r = 1.0
+        reroute_msg = {'routingList': []}
+        reroute_msg['routingList'].append(self.routing(indexs_path))
+        # polled directly like the settle loop, the load monitor only polls link loads
+        old_intent_load = await self.update_intent_load_async()
+        await self.client.post_json_async(('http://%s:%d/onos/v1/imrx/imrx/reRouteIntents' % (ONOS_IP, ONOS_PORT)), json.dumps(reroute_msg))
+
+        if await self.wait_flows_installed_async(indexs_path):
+            # wait until intent throughput is stable, link loads are sampled alongside
+            new_intent_load = await self.wait_load_settled_async()
+            change = new_intent_load - old_intent_load
+            if old_intent_load > 0:
+                r += change/old_intent_load
+        else:
+            await self.update_network_load_async()
+
+        # s = route_args + network state, valid until the next step
+        self.next_state_builder.set_traffic(self.traffic_state())
+        s_ = self.next_state_builder.set_embedding(self.node_embeddinged[indexs_path[-1]])
+        return s_, r
+
+    # reRouteIntents routingList entry moving the intent onto indexs_path
+    def routing(self, indexs_path, intent=None):
+        intent = self.tracked_intent if intent is None else intent
         path = []
         # add src host mac
-        path.append(self.tracked_intent['src_host'])
+        path.append(intent['src_host'])
 
         # add switch
         for i in range(len(indexs_path)):
@@ -101,97 +203,147 @@ class ONOSEnv():
             path.append(index)
 
         # add dst host mac
-        path.append(self.tracked_intent['dst_host'])
+        path.append(intent['dst_host'])
+        return {'key': intent['key'], 'appId': {'name': intent['app_name']},
+                'paths': [{'path': path, 'weight': 1.0}]}
 
-        reroute_msg = {'routingList': []}
-        reroute_msg['routingList'].append(
-            {'key': self.tracked_intent['key'], 'appId': {'name': self.tracked_intent['app_name']},
-             'paths': [{'path': path, 'weight': 1.0}]}
-        )
-        # here shuold add get now load, change to get last recently load in future
-        old_intent_load = self.update_intent_load()
-        json_post_req(('http://%s:%d/onos/v1/imrx/imrx/reRouteIntents' % (ONOS_IP, ONOS_PORT)), json.dumps(reroute_msg))
-
-        # avoid run to long time
-        soldier = 0
-        devices = dict()
-        flag = False
+    # poll the new path flow stats with growing intervals until every path device reports ADDED
+    async def wait_flows_installed_async(self, indexs_path, intent=None):
+        intent = self.tracked_intent if intent is None else intent
         req_str = 'http://%s:%d/onos/v1/imrx/imrx/intentStatsNew/%s/%s' \
                   % (ONOS_IP,
                      ONOS_PORT,
-                     self.tracked_intent['app_name'],
-                     self.tracked_intent['url_key'])
-        # new path
-        # print(req_str)
-        while soldier < 5:
-            # every retry wait 2s
-            time.sleep(2)
-            devices.clear()
-            reply = json_get_req(req_str)
-            # valid exits statistics
-            if 'statistics' not in reply or len(reply['statistics']) != 1:
-                soldier += 1
-                continue
-            # only one object
-            app_stat = reply['statistics'][0]
-            intent_stat = app_stat['intents'][0]
-            (key, items), = intent_stat.items()
-            # here have some problem
-            # if one flow is not added break and start next try
-            for stat in items:
-                device = stat['deviceId']
-                if stat['state'] != 'ADDED' \
-                        or self.deviceId_to_arrayIndex.get(device) is None:
-                    break
-                # collect stats device id
-                else:
-                    devices[device] = device
-
-            # valid path node not in path
-            if len(devices) == len(indexs_path):
-                internalFlag = True
-                for index in indexs_path:
-                    pathDevice = self.arrayIndex_to_deviceId[index]
-                    # path node is not in the flow stats
-                    if devices.get(pathDevice) is None:
-                        internalFlag = False
-                        break
-                if internalFlag:
-                    flag = True
-                    break
-            soldier += 1
+                     intent['app_name'],
+                     intent['url_key'])
+        path_devices = set(self.arrayIndex_to_deviceId[index] for index in indexs_path)
+        interval = FLOW_POLL_INTERVAL
+        deadline = self.client.time() + FLOW_INSTALL_TIMEOUT
+        while True:
+            reply = await self.client.get_json_async(req_str)
+            if self.flows_added(reply, path_devices):
+                return True
+            if self.client.time() + interval > deadline:
+                return False
+            await self.client.sleep_async(interval)
+            interval = min(interval * FLOW_POLL_BACKOFF, FLOW_POLL_MAX_INTERVAL)
 
-        if flag:
-            # wait 60 second ,make flow stable
-            time.sleep(60)
-            new_intent_load = self.update_intent_load()
-            change = new_intent_load - old_intent_load
-            if old_intent_load > 0:
-                r += change/old_intent_load
+    # the flows of exactly the path devices are ADDED
+    def flows_added(self, reply, path_devices):
+        # valid exits statistics, only one object
+        if 'statistics' not in reply or len(reply['statistics']) != 1:
+            return False
+        intent_stat = reply['statistics'][0]['intents'][0]
+        (key, items), = intent_stat.items()
+        devices = set()
+        for stat in items:
+            if stat['state'] != 'ADDED' or self.deviceId_to_arrayIndex.get(stat['deviceId']) is None:
+                return False
+            devices.add(stat['deviceId'])
+        return devices == path_devices
 
-        self.update_network_load()
-        embeddinged_route_args = self.get_embeddinged_route_args(indexs_path[-1])
-        # flattened traffic
-        now_traffic = self.env_loads.flatten()
-        # s = route_args + network state
-        s_ = np.append(embeddinged_route_args, now_traffic)
-        return s_, r
+    # sample intent load (and link loads) until a rolling window is stable, returns the window mean
+    async def wait_load_settled_async(self):
+        samples = deque(maxlen=SETTLE_WINDOW)
+        deadline = self.client.time() + SETTLE_TIMEOUT
+        while True:
+            load, _ = await asyncio.gather(self.intent_load_sample_async(),
+                                           self.update_network_load_async(force=True))
+            if load is not None:
+                samples.append(load)
+                if len(samples) == SETTLE_WINDOW and is_stable(samples, SETTLE_THRESHOLD):
+                    break
+            if self.client.time() + SETTLE_INTERVAL > deadline:
+                break
+            await self.client.sleep_async(SETTLE_INTERVAL)
+        if len(samples) == 0:
+            return 0
+        print(bps_to_human_string(samples[-1]))
+        return float(np.mean(samples))
 
-    # action = an array REPESENTATTION_SIZE
+    # action = an array REPESENTATTION_SIZE or a batch of actions (K, REPESENTATTION_SIZE)
     # neighbor_nodes neighbor index
     def compare_node(self, action, neighbor_nodes):
-        min_distance = 1
-        index = 0
-        action_vector = np.mat(action)
-        for i in range(len(neighbor_nodes)):
-            embedding_vector = np.mat(self.node_embeddinged[neighbor_nodes[i]])
-            distance = np.sqrt((action_vector-embedding_vector)*(action_vector-embedding_vector).T)
-            if distance < min_distance:
-                index = i
-                min_distance = distance
-        return neighbor_nodes[index]
-
-    def node_embedding(self):
+        neighbor_nodes = np.asarray(neighbor_nodes)
+        block = self.node_embeddinged[neighbor_nodes]
+        return neighbor_nodes[self.nearest(action, block, np.einsum('ij,ij->i', block, block))]
+
+    # same as compare_node(action, get_node_neighbors(node_index)) on the precomputed neighbor block
+    def decode_action(self, action, node_index):
+        start, end = self.adj_indptr[node_index], self.adj_indptr[node_index + 1]
+        return self.adj_indices[start + self.nearest(action, self.neighbor_embeddings[start:end],
+                                                     self.neighbor_sq_norms[start:end])]
+
+    # decode_action for K actions taken at K nodes in one pass over their concatenated neighbor blocks,
+    # nodes without neighbors decode to themselves
+    def decode_actions(self, actions, node_indices):
+        node_indices = np.asarray(node_indices)
+        starts = self.adj_indptr[node_indices]
+        counts = self.adj_indptr[node_indices + 1] - starts
+        ends = np.cumsum(counts)
+        # rows of the neighbor blocks, grouped by action
+        rows = np.repeat(starts - ends + counts, counts) + np.arange(ends[-1] if len(ends) else 0)
+        owner = np.repeat(np.arange(len(node_indices)), counts)
+        scores = self.neighbor_sq_norms[rows] - 2.0 * np.einsum('ij,ij->i', self.neighbor_embeddings[rows],
+                                                                np.asarray(actions)[owner])
+        # sorted by action then score the best neighbor opens each group, ties keep the first row like argmin
+        order = np.lexsort((scores, owner))
+        best = rows[order[np.minimum(ends - counts, len(rows) - 1)]] if len(rows) else starts
+        return np.where(counts > 0, self.adj_indices[np.minimum(best, len(self.adj_indices) - 1)], node_indices)
+
+    # index of the nearest row of block for each action, |a-b|^2 = |b|^2 - 2ab + |a|^2 and |a|^2 does not change argmin
+    @staticmethod
+    def nearest(action, block, sq_norms):
+        return np.argmin(sq_norms - 2.0 * np.dot(action, block.T), axis=-1)
+
+    def build_neighbor_blocks(self):
+        self.neighbor_embeddings = self.node_embeddinged[self.adj_indices]
+        self.neighbor_sq_norms = np.einsum('ij,ij->i', self.neighbor_embeddings, self.neighbor_embeddings)
+
+    # rebuilt whenever env_wires changes
+    def build_adjacency(self):
+        src, dst = np.nonzero(self.env_wires != -1)
+        self.adj_indices = dst
+        self.adj_indptr = np.zeros(self.active_nodes + 1, dtype=int)
+        np.cumsum(np.bincount(src, minlength=self.active_nodes), out=self.adj_indptr[1:])
+        if len(self.node_embeddinged) == self.active_nodes:
+            self.build_neighbor_blocks()
+
+    def node_embedding(self, incremental=False):
+        # given embeddings are kept across link changes, the actions of their user are in their basis
+        if self.embeddings is not None:
+            if len(self.embeddings) != self.active_nodes:
+                raise ValueError("Given embeddings are for %d nodes, the topology has %d"
+                                 % (len(self.embeddings), self.active_nodes))
+            self.node_embeddinged = np.array(self.embeddings, dtype=float)
+            print("onde embedding given")
+            return
+        engine = self.embedding_engine
+        cache = EmbeddingCache() if EMBEDDING_CACHE else None
+        if cache is not None:
+            key = cache.key(self.env_wires, self.devices, dict(engine.params(), backend=EMBEDDING_BACKEND))
+            vectors = cache.get(key)
+            if vectors is not None:
+                self.node_embeddinged = vectors
+                # the engine continues from the fit of the cached embeddings on the next link change
+                state = cache.get_state(key)
+                if state is not None:
+                    engine.set_state(state)
+                print("onde embedding loaded from cache")
+                return
+        if EMBEDDING_BACKEND == 'openne':
+            self.node_embedding_openne()
+        elif incremental and engine.can_update(self.env_wires):
+            # re-walks the neighborhood of the changed links
+            self.node_embeddinged = engine.update(self.env_wires)
+            print("onde embedding updated")
+        else:
+            self.node_embeddinged = engine.fit(self.env_wires)
+            print("onde embedding successfully")
+        if cache is not None and np.any(self.node_embeddinged):
+            cache.put(key, self.node_embeddinged, engine.state())
+
+    # run the external OpenNE tool on an edge list file
+    def node_embedding_openne(self):
         self.node_embeddinged = np.full([self.active_nodes, REPESENTATTION_SIZE], 0.0, dtype=float)
         output = open(self.folder + EMBEDDINGINPUT, 'w')
         lines = []
@@ -249,29 +401,98 @@ class ONOSEnv():
         print("onde embedding successfully")
         return
 
-    def update_network_load(self):
-        reply = json_get_req('http://%s:%d/onos/v1/tm/tm/getLinksLoad' % (ONOS_IP, ONOS_PORT))
-        if 'links' not in reply:
-            print('Update netowrk load Failed : can not find links')
+    def update_network_load(self, force=False):
+        return self.run(self.update_network_load_async(force))
+
+    # with the background monitor running the latest snapshot is used unless force asks for a fresh poll
+    async def update_network_load_async(self, force=False):
+        if self.monitor is not None and not force:
+            # a snapshot older than the last direct poll would roll env_loads back
+            if self.monitor.poll_time() >= self.direct_poll_time:
+                # env_loads no longer matches the last direct poll
+                self.links_validator = {}
+                self.direct_poll_time = float('-inf')
+                self.links_changed = self.monitor.read(self.env_loads)
+            else:
+                self.links_changed = 0
+        else:
+            start = self.client.time()
+            reply = await self.client.get_json_if_changed_async('http://%s:%d/onos/v1/tm/tm/getLinksLoad'
+                                                                % (ONOS_IP, ONOS_PORT), self.links_validator)
+            self.ingest_network_load(reply)
+            self.direct_poll_time = start
+        if self.topology_changed:
+            # a link went down or came up, re-read the links and update the embeddings
+            self.topology_changed = False
+            self.refresh_topology()
+        self.log_network_load()
+        return self.links_changed
+
+    def log_network_load(self):
+        if self.traffic_log is None:
             return
-        for link in reply['links']:
-            src = link['src']['device']
-            src_index = self.deviceId_to_arrayIndex[src]
-            dst = link['dst']['device']
-            dst_index = self.deviceId_to_arrayIndex[dst]
-            load = link['load']
-            self.env_loads[src_index][dst_index] = load
+        labels = None
+        if self.traffic_log.records == 0:
+            labels = {i: [self.arrayIndex_to_deviceId[src], self.arrayIndex_to_deviceId[dst]]
+                      for i, (src, dst) in enumerate(zip(self.link_src, self.link_dst))}
+        self.traffic_log.append(self.client.time(), self.env_loads[self.link_src, self.link_dst], labels)
+
+    # write a getLinksLoad reply into env_loads (or out) with one scatter, returns how many link loads changed
+    def ingest_network_load(self, reply, out=None):
+        target = self.env_loads if out is None else out
+        # None: same reply as the last poll
+        if reply is None:
+            changed = 0
+        elif 'links' not in reply:
+            print('Update netowrk load Failed : can not find links')
+            return 0
+        else:
+            links = reply['links']
+            keys = [(link['src']['device'], link['dst']['device']) for link in links]
+            # replies list the links in the same order, the flat indexes are only looked up again when it changes;
+            # the layout is swapped as one tuple, the load monitor ingests from its own thread
+            layout = self.reply_layout
+            if layout is None or keys != layout[0]:
+                index = np.asarray([self.link_flat_index(key) for key in keys], dtype=int)
+                layout = self.reply_layout = (keys, index[index >= 0], index >= 0)
+                if set(keys) != set(self.link_key_index):
+                    # may run on the monitor thread, the refresh is left to update_network_load_async
+                    self.topology_changed = True
+            keys, index, known = layout
+            loads = np.fromiter((link['load'] for link in links), dtype=float, count=len(links))[known]
+            flat_loads = target.reshape(-1)
+            changed = int(np.count_nonzero(flat_loads[index] != loads))
+            flat_loads[index] = loads
         # print("network load update successfully")
+        if out is None:
+            self.links_changed = changed
+        return changed
+
+    # index of a (src device, dst device) link in the flattened load matrix, -1 for unknown devices
+    def link_flat_index(self, key):
+        if key in self.link_key_index:
+            return self.link_key_index[key]
+        src_index = self.deviceId_to_arrayIndex.get(key[0])
+        dst_index = self.deviceId_to_arrayIndex.get(key[1])
+        if src_index is None or dst_index is None:
+            return -1
+        return src_index * self.active_nodes + dst_index
 
     # need myself onos apps traffic-tracker
+    # returns the (src_index, dst_index) links added, removed or changed since the last call
     def update_links(self):
+        reply = self.client.get_json('http://%s:%d/onos/v1/tm/tm/getLinksLoad' % (ONOS_IP, ONOS_PORT))
+        if 'links' not in reply:
+            return []
+        previous_wires = self.env_wires
+        self.link_key_index = {}
+        # env_loads is rebuilt, the next load poll must not be skipped as unchanged
+        self.links_validator = {}
+        self.reply_layout = None
         # init loads and wires
         self.env_loads = np.full([self.active_nodes] * 2, -1.0, dtype=float)
         self.env_wires = np.full([self.active_nodes] * 2, -1.0, dtype=float)
         self.env_ports = np.full([self.active_nodes] * 2, -1.0, dtype=float)
-        reply = json_get_req('http://%s:%d/onos/v1/tm/tm/getLinksLoad' % (ONOS_IP, ONOS_PORT))
-        if 'links' not in reply:
-            return
         for link in reply['links']:
             src_port = link['src']['port']
             # dst_port = link['dst']['port']
@@ -286,15 +507,41 @@ class ONOSEnv():
             self.env_loads[src_index][dst_index] = load
             self.env_wires[src_index][dst_index] = wire
             self.env_ports[src_index][dst_index] = src_port
+            self.link_key_index[(src, dst)] = src_index * self.active_nodes + dst_index
+        if len(self.link_src) == 0:
+            self.link_src, self.link_dst = np.nonzero(self.env_wires != -1)
+        changes = []
+        if len(previous_wires) == self.active_nodes:
+            changes = list(zip(*np.nonzero(previous_wires != self.env_wires)))
+            for src_index, dst_index in changes:
+                # the graph is undirected, drop the edge once neither direction exists
+                if self.env_wires[src_index][dst_index] == -1 and self.env_wires[dst_index][src_index] == -1:
+                    src = self.arrayIndex_to_deviceId[src_index]
+                    dst = self.arrayIndex_to_deviceId[dst_index]
+                    if self.G.has_edge(src, dst):
+                        self.G.remove_edge(src, dst)
+        self.build_adjacency()
         # vector_to_file(matrix_to_onos_v(self.env_loads), self.folder + LOADS, 'w')
         vector_to_file(matrix_to_onos_v(self.env_wires), self.folder + WIRES, 'w')
         # vector_to_file(matrix_to_onos_v(self.env_ports), self.folder + PORTS, 'w')
         print("links update successfully")
-        return
+        return changes
+
+    # re-read the links, when they changed update the embeddings from the previous ones
+    def refresh_topology(self):
+        changes = self.update_links()
+        if len(changes) > 0:
+            self.node_embedding(incremental=True)
+            self.build_neighbor_blocks()
+            # snapshots were taken on the old load matrix
+            if self.monitor is not None:
+                self.stop_monitor()
+                self.start_monitor()
+        return changes
 
     def update_device(self):
         logging.info("Retrieving Topology...")
-        reply = json_get_req('http://%s:%d/onos/v1/devices' % (ONOS_IP, ONOS_PORT))
+        reply = self.client.get_json('http://%s:%d/onos/v1/devices' % (ONOS_IP, ONOS_PORT))
         if 'devices' not in reply:
             return
         self.active_nodes = 0
@@ -310,7 +557,7 @@ class ONOSEnv():
         return
 
     def update_host(self):
-        reply = json_get_req('http://%s:%d/onos/v1/hosts' % (ONOS_IP, ONOS_PORT))
+        reply = self.client.get_json('http://%s:%d/onos/v1/hosts' % (ONOS_IP, ONOS_PORT))
         if 'hosts' not in reply:
             return
         for host in reply['hosts']:
@@ -323,21 +570,20 @@ class ONOSEnv():
 
     # radmon chose a intent ro track,until get a intent with a ip protocol
     def chose_intent(self):
-        reply = json_get_req('http://%s:%d/onos/v1/intents' % (ONOS_IP, ONOS_PORT))
+        reply = self.client.get_json('http://%s:%d/onos/v1/intents' % (ONOS_IP, ONOS_PORT))
         if 'intents' not in reply:
             return
-        intents = reply['intents']
+        intents = self.intent_candidates(reply['intents'])
         if len(intents) == 0:
             print("no one intent")
 
-        # chose a intent withe IP_PROTO
-        while True:
-            # radmon chose one intent
-            intent_index = random.randint(0, len(intents)-1)
-            intent = intents[intent_index]
+        # chose a intent withe IP_PROTO, trying each candidate once in random order
+        for intent in random.sample(intents, len(intents)):
             if intent['state'] != 'INSTALLED':
                 continue
 
+            # nothing left over from the previous candidate
+            self.tracked_intent = {}
             # org.onosproject.eifwd
             self.tracked_intent['app_name'] = intent['appId']
             # 56:60:C7:C8:CD:7B/None-72:06:C3:73:5C:A5/None
@@ -359,9 +605,16 @@ class ONOSEnv():
             self.update_tracked_intent()
             monitored = self.monitor_intent()
             if 'IP_PROTO' in self.tracked_intent and monitored:
-                break
-        print("chose intent successfully")
-        return
+                print("chose intent successfully")
+                return
+        raise Exception("Set up intent Error! None of the %d candidate intents can be tracked" % len(intents))
+
+    # the intents of intent_slice, all of them without one
+    def intent_candidates(self, intents):
+        if self.intent_slice is None:
+            return intents
+        index, count = self.intent_slice
+        return sorted(intents, key=lambda intent: intent['key'])[index::count]
 
     # need myself application imrx
     def monitor_intent(self):
@@ -369,8 +622,8 @@ class ONOSEnv():
         msg['name'] = self.tracked_intent['app_name']
         msg['intentKey'] = self.tracked_intent['key']
 
-        result = json_post_req(('http://%s:%d/onos/v1/imrx/imrx/startMonitorIntent'
-                                % (ONOS_IP, ONOS_PORT)), json.dumps(msg))
+        result = self.client.post_json(('http://%s:%d/onos/v1/imrx/imrx/startMonitorIntent'
+                                        % (ONOS_IP, ONOS_PORT)), json.dumps(msg))
         return 'Failed' not in json.dumps(result)
 
     # the key of intent is src_host_mac-dst_host_mac
@@ -415,7 +668,7 @@ class ONOSEnv():
                      ONOS_PORT,
                      self.tracked_intent['app_name'],
                      self.tracked_intent['url_key'])
-        reply = json_get_req(req_str)
+        reply = self.client.get_json(req_str)
         if len(reply['paths']) == 0:
             return
         intent_flow = reply['paths'][0][0]
@@ -433,45 +686,52 @@ class ONOSEnv():
 
     # update intent load
     def update_intent_load(self):
+        return self.run(self.update_intent_load_async())
+
+    async def update_intent_load_async(self, intent=None):
         soilder = 0
         load = 0
         # avoid in refresh time (default 2 second to get port stats)
         while soilder < 3:
             soilder += 1
             if soilder != 1:
-                time.sleep(3)
-            req_str = 'http://%s:%d/onos/v1/imrx/imrx/intentLoad/%s/%s' \
-                       % (ONOS_IP,
-                          ONOS_PORT,
-                          self.tracked_intent['app_name'],
-                          self.tracked_intent['url_key'])
-            reply = json_get_req(req_str)
-            if 'load' not in reply:
+                await self.client.sleep_async(3)
+            sample = await self.intent_load_sample_async(intent)
+            if sample is None:
                 continue
-            load = reply['load']
+            load = sample
             print(bps_to_human_string(load))
             if load != 0:
                 break
         return load
 
-    # reset env network loads
-    def reset(self):
+    async def intent_load_sample_async(self, intent=None):
+        intent = self.tracked_intent if intent is None else intent
+        req_str = 'http://%s:%d/onos/v1/imrx/imrx/intentLoad/%s/%s' \
+                   % (ONOS_IP,
+                      ONOS_PORT,
+                      intent['app_name'],
+                      intent['url_key'])
+        reply = await self.client.get_json_async(req_str)
+        if 'load' not in reply:
+            return None
+        return reply['load']
+
+    # reset env network loads, force polls them even when the background monitor is running
+    def reset(self, force=False):
+        return self.run(self.reset_async(force))
+
+    async def reset_async(self, force=False):
         # get the src node index
         src_idex = self.initial_route_args[-1]
 
-        # embeddinged route args
-        embeddinged_route_args = self.get_embeddinged_route_args(src_idex)
-
         # update network load
-        self.update_network_load()
-
-        # flattened traffic
-        now_traffic = self.env_loads.flatten()
+        await self.update_network_load_async(force)
 
-        # s = embedding_route_args + traffic
-        now_mix_s = np.append(embeddinged_route_args, now_traffic)
-        self.now_s = now_mix_s
-        self.now_traffic = now_traffic
+        # s = embedding_route_args + traffic, valid until the next reset
+        self.state_builder.set_traffic(self.traffic_state())
+        self.now_s = self.state_builder.set_embedding(self.node_embeddinged[src_idex])
+        self.now_traffic = self.state_builder.traffic
 
     # route_args =[srcip0，srcip1，srcip2，srcip3，srcprefix,desip0，desip1，desip2，desip3,dstprefix，sport，dport，protocol，currentPositionIndex]
     def set_up_route_args(self):
@@ -498,35 +758,56 @@ class ONOSEnv():
         self.initial_route_args = np.asarray(self.initial_route_args, dtype=int)
         print("init route args")
 
-    def get_embeddinged_route_args(self, embedding_index):
-        node_embedding = self.node_embeddinged[embedding_index]
-        part_one = self.initial_route_args[0:-1]
-        return np.append(part_one, node_embedding)
+    def set_up_state(self):
+        route_args = self.initial_route_args[0:-1]
+        traffic_size = np.size(self.traffic_state())
+        self.state_builder = StateBuilder(route_args, REPESENTATTION_SIZE, traffic_size)
+        self.next_state_builder = StateBuilder(route_args, REPESENTATTION_SIZE, traffic_size)
+        self.hop_state_builder = StateBuilder(route_args, REPESENTATTION_SIZE, traffic_size)
+
+    # network part of the state, see STATE_LAYOUT
+    # links that disappear keep their place in the link order and read -1 like in the dense layout
+    def traffic_state(self):
+        if STATE_LAYOUT == 'dense':
+            return self.env_loads
+        loads = self.env_loads[self.link_src, self.link_dst]
+        if not STATE_LINK_UTILIZATION:
+            return loads
+        wires = self.env_wires[self.link_src, self.link_dst]
+        utilization = np.divide(loads, wires, out=np.full(len(loads), -1.0), where=wires > 0)
+        return np.concatenate((loads, utilization))
+
+    @property
+    def state_dim(self):
+        return len(self.state_builder.buffer)
 
     # valid it by wires
     def is_dst_neighbor(self, src_index):
         dst_index = self.tracked_intent['dst_index']
-        return self.env_wires[src_index][dst_index] != -1
+        neighbor = self.get_node_neighbors(src_index)
+        # CSR rows are sorted
+        position = neighbor.searchsorted(dst_index)
+        return position < len(neighbor) and neighbor[position] == dst_index
 
+    # view into the CSR adjacency, do not modify
     def get_node_neighbors(self, node_index):
-        neighbor = []
-        for i in range(self.active_nodes):
-            if self.env_wires[node_index][i] != -1:
-                neighbor.append(i)
-        return neighbor
-
-    def monitor_load(self):
-        count = 0
-        fig, ax = plt.subplots()
-        ax.set_ylim(0, DEFAULT_ACCESS_CAPACITY/1024)
-        xs = []
-        ys = []
-        while self.monitor_load_bool:
-            time.sleep(2)
-            load = self.update_intent_load()
-            ys.append(load/1024)
-            xs.append(count * 3)
-            count += 1
-            plt.plot(xs, ys)
-            plt.pause(0.1)
-
+        return self.adj_indices[self.adj_indptr[node_index]:self.adj_indptr[node_index + 1]]
+
+    # poll link loads every POLLING_INTERVAL in the background, reset and step then read the latest snapshot
+    def start_monitor(self, interval=POLLING_INTERVAL):
+        if self.monitor is None:
+            self.monitor = LoadMonitor(self, interval)
+            self.monitor.start()
+
+    def stop_monitor(self):
+        if self.monitor is not None:
+            self.monitor.stop()
+            self.monitor = None
+
+    # stop the monitor and release the log files and the loop, the env is not usable afterwards
+    def close(self):
+        self.stop_monitor()
+        if self.traffic_log is not None:
+            self.traffic_log.close()
+            self.traffic_log = None
+        self.loop.close()
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import threading
+import time
+import numpy as np
+from config import *
+
+# real time between two looks at the client clock while waiting for the next poll
+CLOCK_CHECK_INTERVAL = 0.05
+
+
+# polls link loads on a daemon thread every interval of the client clock, the tracked intent load is read
+# directly by step since a snapshot could predate the settling of the previous reroute.
+# Loads are written into the back one of two buffers, then the snapshot reference is swapped;
+# readers never block, a per buffer sequence number tells them to retry if a write overlapped their copy
+class LoadMonitor(object):
+    def __init__(self, env, interval=POLLING_INTERVAL):
+        self.env = env
+        self.interval = interval
+        self.buffers = [np.array(env.env_loads), np.array(env.env_loads)]
+        # odd while the buffer is being written
+        self.versions = [0, 0]
+        # (buffer index, client time the poll was sent), replaced as a whole
+        self.snapshot = (0, env.client.time())
+        self.validator = {}
+        self.polls = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='LoadMonitor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    loop.run_until_complete(self.poll_async())
+                except Exception as e:
+                    logging.error(e)
+                self.wait_next_poll()
+        finally:
+            loop.close()
+
+    # interval after the last poll on the client clock; a virtual clock only moves when the env sleeps,
+    # the monitor must not advance it itself
+    def wait_next_poll(self):
+        due = self.snapshot[1] + self.interval
+        while not self.stopped.is_set():
+            remaining = due - self.env.client.time()
+            if remaining <= 0:
+                return
+            self.stopped.wait(min(remaining, CLOCK_CHECK_INTERVAL))
+
+    async def poll_async(self):
+        env = self.env
+        start = env.client.time()
+        reply = await env.client.get_json_if_changed_async('http://%s:%d/onos/v1/tm/tm/getLinksLoad'
+                                                           % (ONOS_IP, ONOS_PORT), self.validator)
+        front = self.snapshot[0]
+        back = 1 - front
+        if reply is not None:
+            self.versions[back] += 1
+            self.buffers[back][...] = self.buffers[front]
+            env.ingest_network_load(reply, self.buffers[back])
+            self.versions[back] += 1
+        else:
+            # links unchanged, republish the same buffer
+            back = front
+        self.snapshot = (back, start)
+        self.polls += 1
+
+    # copy the freshest link loads into out, returns how many entries changed
+    def read(self, out):
+        while True:
+            index, timestamp = self.snapshot
+            version = self.versions[index]
+            if version % 2 == 0:
+                loads = self.buffers[index]
+                changed = int(np.count_nonzero(out != loads))
+                np.copyto(out, loads)
+                if self.versions[index] == version:
+                    return changed
+            # the poll thread is writing this buffer, let it run
+            time.sleep(0)
+
+    def poll_time(self):
+        return self.snapshot[1]
+
+    def age(self):
+        return self.env.client.time() - self.snapshot[1]
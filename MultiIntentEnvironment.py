@@ -0,0 +1,141 @@
+import asyncio
+import json
+import random
+import warnings
+import numpy as np
+from collections import deque
+from config import *
+from utils import is_stable, url_quote
+from Environment import ONOSEnv
+
+
+# ONOSEnv tracking up to intents INSTALLED ip intents at once. One step reroutes all of them with a single
+# reRouteIntents POST, measures their loads together and returns one reward per intent, so a measurement
+# window yields one transition per intent. The first tracked intent is also self.tracked_intent, the
+# single intent API of ONOSEnv keeps working on it
+class MultiIntentONOSEnv(ONOSEnv):
+    def __init__(self, folder, intents=MULTI_INTENTS, client=None, embeddings=None, intent_slice=None):
+        self.intent_count = intents
+        self.tracked_intents = []
+        # (intents, len(initial_route_args)) route args of every tracked intent
+        self.intent_route_args = []
+        self.src_indexes = []
+        self.dst_indexes = []
+        # (intents, state_dim) states of every tracked intent, rows valid until the next reset / step
+        self.now_states = []
+        self.next_states = []
+        ONOSEnv.__init__(self, folder, client, embeddings, intent_slice)
+
+    def chose_intent(self):
+        reply = self.client.get_json('http://%s:%d/onos/v1/intents' % (ONOS_IP, ONOS_PORT))
+        if 'intents' not in reply:
+            return
+        candidates = [intent for intent in self.intent_candidates(reply['intents']) if intent['state'] == 'INSTALLED']
+        random.shuffle(candidates)
+        self.tracked_intents = []
+        for intent in candidates:
+            if len(self.tracked_intents) == self.intent_count:
+                break
+            # the ONOSEnv helpers fill self.tracked_intent
+            self.tracked_intent = {'app_name': intent['appId'], 'key': intent['key'],
+                                   'url_key': url_quote(intent['key'])}
+            self.update_src_dst_locations()
+            if 'src_locations' not in self.tracked_intent:
+                continue
+            self.update_src_dst_location()
+            self.update_tracked_intent()
+            if 'IP_PROTO' in self.tracked_intent and self.monitor_intent():
+                self.tracked_intents.append(self.tracked_intent)
+        self.tracked_intent = self.tracked_intents[0] if self.tracked_intents else {}
+        self.src_indexes = np.array([intent['src_index'] for intent in self.tracked_intents], dtype=int)
+        self.dst_indexes = np.array([intent['dst_index'] for intent in self.tracked_intents], dtype=int)
+        print("chose %d intents successfully" % len(self.tracked_intents))
+
+    def set_up_route_args(self):
+        route_args = []
+        for intent in self.tracked_intents:
+            self.tracked_intent = intent
+            ONOSEnv.set_up_route_args(self)
+            route_args.append(self.initial_route_args)
+        self.intent_route_args = np.array(route_args)
+        self.tracked_intent = self.tracked_intents[0]
+        self.initial_route_args = self.intent_route_args[0]
+
+    def set_up_state(self):
+        ONOSEnv.set_up_state(self)
+        route = slice(0, self.state_builder.embedding_slice.start)
+        self.now_states = np.zeros((len(self.tracked_intents), self.state_dim), dtype=self.state_builder.buffer.dtype)
+        self.now_states[:, route] = self.intent_route_args[:, :-1]
+        self.next_states = np.array(self.now_states)
+
+    async def reset_async(self, force=False):
+        await ONOSEnv.reset_async(self, force)
+        embedding = self.state_builder.embedding_slice
+        self.now_states[:, embedding.stop:] = self.now_traffic
+        self.now_states[:, embedding] = self.node_embeddinged[self.src_indexes]
+        return self.now_states
+
+    # intent loads of one round, the requests run concurrently; NaN for intents without a load
+    async def intent_loads_async(self, intents):
+        loads = await asyncio.gather(*[self.intent_load_sample_async(intent) for intent in intents])
+        return np.array([np.nan if load is None else load for load in loads], dtype=float)
+
+    # paths: one path (array indexes) per tracked intent, None leaves an intent on its route.
+    # Returns the next states (intents, state_dim) and the rewards, -1.0 for invalid paths and 0 for skipped intents
+    async def step_async(self, paths):
+        rewards = np.zeros(len(self.tracked_intents))
+        rerouted = []
+        for i, (intent, path) in enumerate(zip(self.tracked_intents, paths)):
+            if path is None:
+                continue
+            if self.validate_path(path, intent):
+                rerouted.append(i)
+                rewards[i] = 1.0
+            else:
+                rewards[i] = -1.0
+        self.next_states[...] = self.now_states
+        if len(rerouted) == 0:
+            return self.next_states, rewards
+
+        intents = [self.tracked_intents[i] for i in rerouted]
+        # retried on 0 like the single intent step, a transient 0 would otherwise drop the load change from the reward
+        old_loads = np.array(await asyncio.gather(*[self.update_intent_load_async(intent) for intent in intents]),
+                             dtype=float)
+        reroute_msg = {'routingList': [self.routing(paths[i], self.tracked_intents[i]) for i in rerouted]}
+        await self.client.post_json_async(('http://%s:%d/onos/v1/imrx/imrx/reRouteIntents' % (ONOS_IP, ONOS_PORT)),
+                                          json.dumps(reroute_msg))
+        installed = np.array(await asyncio.gather(*[self.wait_flows_installed_async(paths[i], self.tracked_intents[i])
+                                                    for i in rerouted]), dtype=bool)
+        if installed.any():
+            settled = [intent for intent, done in zip(intents, installed) if done]
+            new_loads = await self.wait_loads_settled_async(settled)
+            old = old_loads[installed]
+            change = np.divide(new_loads - old, old, out=np.zeros(len(old)), where=old > 0)
+            rewards[np.array(rerouted)[installed]] += change
+        else:
+            await self.update_network_load_async()
+
+        embedding = self.state_builder.embedding_slice
+        self.next_states[:, embedding.stop:] = np.ravel(self.traffic_state())
+        self.next_states[rerouted, embedding] = self.node_embeddinged[[paths[i][-1] for i in rerouted]]
+        return self.next_states, rewards
+
+    # wait_load_settled_async for several intents: sampled together until every intent is stable.
+    # Failed reads stay NaN and are left out of the stability test and the mean, an intent without any
+    # sample settles at 0 like in wait_load_settled_async
+    async def wait_loads_settled_async(self, intents):
+        samples = deque(maxlen=SETTLE_WINDOW)
+        deadline = self.client.time() + SETTLE_TIMEOUT
+        while True:
+            loads, _ = await asyncio.gather(self.intent_loads_async(intents),
+                                            self.update_network_load_async(force=True))
+            samples.append(loads)
+            if len(samples) == SETTLE_WINDOW and \
+                    all(is_stable(column, SETTLE_THRESHOLD) for column in np.array(samples).T):
+                break
+            if self.client.time() + SETTLE_INTERVAL > deadline:
+                break
+            await self.client.sleep_async(SETTLE_INTERVAL)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nan_to_num(np.nanmean(samples, axis=0))
@@ -0,0 +1,404 @@
+import asyncio
+import base64
+import hashlib
+import http.client
+import json
+import logging
+import select
+import socket
+import threading
+import time
+import urllib.parse
+import weakref
+from config import *
+
+
+# ONOS REST apps are mounted as /onos/v1/<app>/<app>/<resource>/..., core resources as /onos/v1/<resource>/...
+# the trailing segments are usually an app name and an url quoted intent key, keep them out of the endpoint name
+def endpoint_name(path):
+    segments = [_ for _ in path.split('?', 1)[0].split('/') if _ != '']
+    if segments[:2] == ['onos', 'v1']:
+        segments = segments[2:]
+    depth = 3 if len(segments) > 1 and segments[0] == segments[1] else 2
+    return '/'.join(segments[:depth])
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, elapsed):
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def as_dict(self):
+        mean = self.total_time / self.calls if self.calls > 0 else 0.0
+        return {'calls': self.calls, 'errors': self.errors, 'retries': self.retries,
+                'total': self.total_time, 'mean': mean, 'max': self.max_time}
+
+
+class OnosClient(object):
+    # errors after which a keep-alive connection is dropped and the request is sent again on a fresh one
+    RETRY_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionError, socket.timeout)
+    # once sent, only these are sent again: a reRouteIntents POST may already have been applied
+    IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+    def __init__(self, user=ONOS_USER, pwd=ONOS_PASS, timeout=ONOS_TIMEOUT, retries=ONOS_RETRIES,
+                 pool_size=ONOS_POOL_SIZE):
+        payload = '%s:%s' % (user, pwd)
+        self.headers = {
+            'Authorization': 'Basic %s' % base64.b64encode(payload.encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Connection': 'keep-alive',
+        }
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        # (host, port) -> idle connections
+        self.pool = {}
+        self.lock = threading.Lock()
+        self.endpoint_stats = {}
+        # event loop -> (host, port) -> idle asyncio (reader, writer) pairs, dropped with the loop
+        self.async_pool = weakref.WeakKeyDictionary()
+        self.request_head = ''.join('%s: %s\r\n' % item for item in self.headers.items())
+
+    def acquire(self, netloc):
+        while True:
+            with self.lock:
+                idle = self.pool.get(netloc)
+                if not idle:
+                    break
+                conn = idle.pop()
+            if not self.is_stale(conn):
+                return conn
+            conn.close()
+        return http.client.HTTPConnection(netloc[0], netloc[1], timeout=self.timeout)
+
+    # an idle keep-alive socket is readable only when the server closed it (EOF) or sent something unasked,
+    # a request written to it would fail after being sent, past the point where a POST can be retried
+    @staticmethod
+    def is_stale(conn):
+        if conn.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return len(readable) > 0
+
+    def release(self, netloc, conn):
+        with self.lock:
+            idle = self.pool.setdefault(netloc, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def record(self, endpoint, elapsed=None, error=False, retry=False):
+        with self.lock:
+            stats = self.endpoint_stats.get(endpoint)
+            if stats is None:
+                stats = self.endpoint_stats[endpoint] = EndpointStats()
+            if elapsed is not None:
+                stats.add(elapsed)
+            if error:
+                stats.errors += 1
+            if retry:
+                stats.retries += 1
+
+    # returns (status, reason, lower case response headers, body)
+    def exchange(self, method, url, body=None, extra_headers=None):
+        split = urllib.parse.urlsplit(url)
+        netloc = (split.hostname, split.port or 80)
+        path = split.path + ('?' + split.query if split.query else '')
+        endpoint = endpoint_name(split.path)
+        headers = self.headers
+        if body is not None:
+            headers = dict(headers, **{'Content-Type': 'application/json'})
+        if extra_headers:
+            headers = dict(headers, **extra_headers)
+        attempt = 0
+        while True:
+            conn = self.acquire(netloc)
+            start = time.time()
+            sent = False
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    # headers and body are written separately, do not let Nagle hold the body back
+                    conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                conn.request(method, path, body=body, headers=headers)
+                sent = True
+                response = conn.getresponse()
+                data = response.read()
+            except self.RETRY_ERRORS:
+                conn.close()
+                attempt += 1
+                if attempt > self.retries or (sent and method not in self.IDEMPOTENT_METHODS):
+                    self.record(endpoint, error=True)
+                    raise
+                self.record(endpoint, retry=True)
+                # stale keep-alive connections fail at once, only back off on later attempts
+                time.sleep(0.1 * (attempt - 1))
+                continue
+            except Exception:
+                conn.close()
+                self.record(endpoint, error=True)
+                raise
+            self.record(endpoint, time.time() - start, error=response.status >= 400)
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(netloc, conn)
+            return response.status, response.reason, dict((k.lower(), v) for k, v in response.getheaders()), data
+
+    def request(self, method, url, body=None):
+        status, reason, headers, data = self.exchange(method, url, body)
+        if status >= 400:
+            raise IOError('HTTP Error %d: %s (%s)' % (status, reason, url))
+        return data
+
+    def get_json(self, url):
+        try:
+            return json.loads(self.request('GET', url).decode('utf-8'))
+        except (IOError, http.client.HTTPException, ValueError) as e:
+            logging.error(e)
+            return ''
+
+    def post_json(self, url, json_data):
+        try:
+            # json to bytes
+            data = bytes(json_data, encoding='utf-8')
+            return json.loads(self.request('POST', url, data).decode('utf-8'))
+        except (IOError, http.client.HTTPException, ValueError) as e:
+            logging.error(e)
+            return ''
+
+    # asyncio streams are bound to the loop that opened them
+    async def acquire_async(self, netloc):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.lock:
+                idle = self.async_pool.get(loop, {}).get(netloc)
+                if not idle:
+                    break
+                reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        reader, writer = await asyncio.open_connection(netloc[0], netloc[1])
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return reader, writer
+
+    def release_async(self, netloc, conn):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            # the idle streams reference their loop, the weak key alone never lets a closed one go
+            for closed in [_ for _ in self.async_pool.keys() if _.is_closed()]:
+                self.drop_async_pool(closed)
+            idle = self.async_pool.setdefault(loop, {}).setdefault(netloc, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn[1].close()
+
+    # call with self.lock held
+    def drop_async_pool(self, loop):
+        for idle in self.async_pool.pop(loop).values():
+            for reader, writer in idle:
+                if not loop.is_closed():
+                    writer.close()
+                    continue
+                # a closed loop cannot run the transport close, shut the socket down, gc releases it
+                sock = writer.get_extra_info('socket')
+                if sock is not None:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+    @staticmethod
+    async def read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by peer')
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if size == 0:
+                    # trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b''.join(chunks)
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return int(status), reason, headers, data, keep_alive
+
+    async def exchange_async(self, method, url, body=None, extra_headers=None):
+        split = urllib.parse.urlsplit(url)
+        netloc = (split.hostname, split.port or 80)
+        path = split.path + ('?' + split.query if split.query else '')
+        endpoint = endpoint_name(split.path)
+        head = '%s %s HTTP/1.1\r\nHost: %s:%d\r\n%s' % (method, path, netloc[0], netloc[1], self.request_head)
+        if body is not None:
+            head += 'Content-Type: application/json\r\nContent-Length: %d\r\n' % len(body)
+        for name, value in (extra_headers or {}).items():
+            head += '%s: %s\r\n' % (name, value)
+        message = (head + '\r\n').encode('latin-1') + (body or b'')
+        attempt = 0
+        while True:
+            conn = None
+            start = time.time()
+            sent = False
+            try:
+                conn = await asyncio.wait_for(self.acquire_async(netloc), self.timeout)
+                conn[1].write(message)
+                sent = True
+                status, reason, headers, data, keep_alive = await asyncio.wait_for(self.read_response(conn[0]),
+                                                                                   self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                if conn is not None:
+                    conn[1].close()
+                attempt += 1
+                if attempt > self.retries or (sent and method not in self.IDEMPOTENT_METHODS):
+                    self.record(endpoint, error=True)
+                    raise
+                self.record(endpoint, retry=True)
+                await asyncio.sleep(0.1 * (attempt - 1))
+                continue
+            except Exception:
+                if conn is not None:
+                    conn[1].close()
+                self.record(endpoint, error=True)
+                raise
+            self.record(endpoint, time.time() - start, error=status >= 400)
+            if keep_alive:
+                self.release_async(netloc, conn)
+            else:
+                conn[1].close()
+            return status, reason, headers, data
+
+    async def request_async(self, method, url, body=None):
+        status, reason, headers, data = await self.exchange_async(method, url, body)
+        if status >= 400:
+            raise IOError('HTTP Error %d: %s (%s)' % (status, reason, url))
+        return data
+
+    async def get_json_async(self, url):
+        try:
+            return json.loads((await self.request_async('GET', url)).decode('utf-8'))
+        except (IOError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+            logging.error(e)
+            return ''
+
+    async def post_json_async(self, url, json_data):
+        try:
+            data = bytes(json_data, encoding='utf-8')
+            return json.loads((await self.request_async('POST', url, data)).decode('utf-8'))
+        except (IOError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+            logging.error(e)
+            return ''
+
+    # conditional GET: None when the reply did not change since the last call with the same validator dict,
+    # by ETag (304) when the server sends one, otherwise by a digest of the body
+    def get_json_if_changed(self, url, validator):
+        try:
+            return self.parse_if_changed(self.exchange('GET', url, extra_headers=self.conditional(validator)),
+                                         url, validator)
+        except (IOError, http.client.HTTPException, ValueError) as e:
+            logging.error(e)
+            return ''
+
+    async def get_json_if_changed_async(self, url, validator):
+        try:
+            return self.parse_if_changed(await self.exchange_async('GET', url, extra_headers=self.conditional(validator)),
+                                         url, validator)
+        except (IOError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+            logging.error(e)
+            return ''
+
+    @staticmethod
+    def conditional(validator):
+        return {'If-None-Match': validator['etag']} if validator.get('etag') else None
+
+    @staticmethod
+    def parse_if_changed(response, url, validator):
+        status, reason, headers, data = response
+        if status == 304:
+            return None
+        if status >= 400:
+            raise IOError('HTTP Error %d: %s (%s)' % (status, reason, url))
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        validator['etag'] = headers.get('etag')
+        if validator.get('digest') == digest:
+            return None
+        validator['digest'] = digest
+        return json.loads(data.decode('utf-8'))
+
+    # clock used by callers for poll deadlines, simulated backends substitute their own
+    def time(self):
+        return time.time()
+
+    def sleep(self, delay):
+        time.sleep(delay)
+
+    async def sleep_async(self, delay):
+        await asyncio.sleep(delay)
+
+    # per endpoint latency counters, seconds
+    def latency_stats(self):
+        with self.lock:
+            return {endpoint: stats.as_dict() for endpoint, stats in self.endpoint_stats.items()}
+
+    def reset_stats(self):
+        with self.lock:
+            self.endpoint_stats = {}
+
+    def close(self):
+        with self.lock:
+            for idle in self.pool.values():
+                for conn in idle:
+                    conn.close()
+            self.pool = {}
+            for loop in list(self.async_pool.keys()):
+                self.drop_async_pool(loop)
+
+
+# client shared by ONOSEnv, StatsManager and the json_*_req helpers
+default_client = None
+
+
+def get_client():
+    global default_client
+    if default_client is None:
+        default_client = OnosClient()
+    return default_client
+
+
+def set_client(client):
+    global default_client
+    default_client = client
@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from config import *
+from OnosClient import OnosClient, endpoint_name
+
+
+class VirtualClock(object):
+    def __init__(self, start=0.0):
+        self.now = start
+        # heap of the deadlines of the coroutines sleeping on this clock
+        self.sleepers = []
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, delay):
+        self.now += delay
+
+    # concurrent sleeps overlap instead of adding up: a coroutine wakes once no other sleeper is due earlier
+    # and moves the clock to its deadline, never back
+    async def sleep_async(self, delay):
+        deadline = self.now + delay
+        heapq.heappush(self.sleepers, deadline)
+        try:
+            # let the other coroutines of the round reach their sleeps
+            await asyncio.sleep(0)
+            while self.sleepers[0] < deadline:
+                await asyncio.sleep(0)
+        finally:
+            self.sleepers.remove(deadline)
+            heapq.heapify(self.sleepers)
+        self.now = max(self.now, deadline)
+
+
+# analytic stand-in for the ONOS REST endpoints used by ONOSEnv and StatsManager:
+# intents get a max-min fair share of the residual link capacity along their path
+class OnosSimulator(object):
+    def __init__(self, topology=SIM_TOPOLOGY, intents=SIM_INTENTS, demand=SIM_DEMAND,
+                 install_delay=SIM_INSTALL_DELAY, seed=None, clock=None):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.install_delay = install_delay
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        with open(topology, encoding='utf-8-sig') as file:
+            reply = json.load(file)
+        # linkload.json is a saved getLinksLoad reply (with a typo in the key)
+        links = reply.get('links', reply.get('lilnks', []))
+
+        self.devices = []
+        self.device_ports = {}
+        self.links = []
+        self.link_index = {}
+        for link in links:
+            src = link['src']['device']
+            dst = link['dst']['device']
+            for device, port in ((src, link['src']['port']), (dst, link['dst']['port'])):
+                if device not in self.device_ports:
+                    self.devices.append(device)
+                    self.device_ports[device] = set()
+                self.device_ports[device].add(int(port))
+            self.link_index[(src, dst)] = len(self.links)
+            self.links.append({'src': dict(link['src']), 'dst': dict(link['dst']), 'wire': link['wire']})
+        self.capacity = np.asarray([link['wire'] for link in links], dtype=float)
+        # recorded loads are kept as background traffic
+        self.background = np.asarray([link.get('load', 0) for link in links], dtype=float)
+        self.neighbors = {device: [] for device in self.devices}
+        for src, dst in self.link_index:
+            self.neighbors[src].append(dst)
+
+        # one host per device on a free port
+        self.hosts = {}
+        for i, device in enumerate(self.devices):
+            mac = '00:00:00:00:%02X:%02X' % (i // 256, i % 256 + 1)
+            host_id = mac + '/None'
+            self.hosts[host_id] = {
+                'id': host_id, 'mac': mac, 'vlan': 'None',
+                'ipAddresses': ['10.0.%d.%d' % (i // 250, i % 250 + 1)],
+                'locations': [{'elementId': device, 'port': str(max(self.device_ports[device]) + 1)}],
+            }
+
+        self.intents = {}
+        host_ids = list(self.hosts)
+        pairs = [(s, d) for s in host_ids for d in host_ids if s != d]
+        for src_host, dst_host in self.random.sample(pairs, min(intents, len(pairs))):
+            key = '%s-%s' % (src_host, dst_host)
+            path = self.shortest_path(self.hosts[src_host]['locations'][0]['elementId'],
+                                      self.hosts[dst_host]['locations'][0]['elementId'])
+            if path is None:
+                continue
+            self.intents[key] = {
+                'key': key, 'app': 'org.onosproject.ifwd', 'id': '0x%x' % len(self.intents),
+                'src_host': src_host, 'dst_host': dst_host,
+                'demand': self.random.uniform(*demand), 'protocol': 6,
+                'src_port': self.random.randint(1024, 65535), 'dst_port': self.random.randint(1024, 65535),
+                'path': path, 'installed_at': self.clock() - self.install_delay,
+                'bytes': 0.0, 'accounted_at': self.clock(),
+            }
+        self.throughput = {}
+        self.link_loads = self.background.copy()
+        self.dirty = True
+
+    def shortest_path(self, src, dst):
+        previous = {src: None}
+        queue = deque([src])
+        while queue:
+            device = queue.popleft()
+            if device == dst:
+                path = []
+                while device is not None:
+                    path.append(device)
+                    device = previous[device]
+                return path[::-1]
+            for neighbor in self.neighbors[device]:
+                if neighbor not in previous:
+                    previous[neighbor] = device
+                    queue.append(neighbor)
+        return None
+
+    def path_links(self, path):
+        return [self.link_index[(path[i], path[i + 1])] for i in range(len(path) - 1)]
+
+    def is_installed(self, intent):
+        return self.clock() >= intent['installed_at'] + self.install_delay
+
+    # max-min fair progressive filling of the residual capacity among installed intents
+    def update_throughput(self):
+        if not self.dirty:
+            return
+        keys = [key for key, intent in self.intents.items() if self.is_installed(intent)]
+        incidence = np.zeros((len(keys), len(self.links)), dtype=float)
+        for i, key in enumerate(keys):
+            incidence[i, self.path_links(self.intents[key]['path'])] = 1.0
+        demand = np.asarray([self.intents[key]['demand'] for key in keys], dtype=float)
+        rate = np.zeros(len(keys), dtype=float)
+        residual = np.maximum(self.capacity - self.background, 0.0)
+        active = demand > 0
+        while active.any():
+            users = incidence[active].sum(axis=0)
+            used = users > 0
+            share = np.min(residual[used] / users[used]) if used.any() else np.inf
+            increment = min(share, np.min(demand[active] - rate[active]))
+            rate[active] += increment
+            residual -= increment * users
+            saturated = used & (residual <= 1e-6 * self.capacity)
+            active &= (rate < demand - 1e-9) & ~(incidence[:, saturated].any(axis=1))
+        for key in self.intents:
+            self.account(self.intents[key])
+        self.throughput = dict(zip(keys, rate))
+        self.link_loads = self.background + rate.dot(incidence)
+        # pending installs change the result once they complete
+        self.dirty = len(keys) != len(self.intents)
+
+    # integrate the transmitted bytes up to now
+    def account(self, intent):
+        now = self.clock()
+        intent['bytes'] += self.throughput.get(intent['key'], 0.0) / 8 * (now - intent['accounted_at'])
+        intent['accounted_at'] = now
+
+    def reroute(self, routing):
+        intent = self.intents.get(routing['key'])
+        if intent is None or len(routing['paths']) == 0:
+            return False
+        # path = src host, switches..., dst host
+        path = [_ for _ in routing['paths'][0]['path'] if _ in self.device_ports]
+        if any((path[i], path[i + 1]) not in self.link_index for i in range(len(path) - 1)):
+            return False
+        self.account(intent)
+        intent['path'] = path
+        intent['installed_at'] = self.clock()
+        intent['bytes'] = 0.0
+        self.throughput.pop(intent['key'], None)
+        self.dirty = True
+        return True
+
+    def flow_stats(self, intent):
+        self.account(intent)
+        state = 'ADDED' if self.is_installed(intent) else 'PENDING_ADD'
+        life = max(self.clock() - intent['installed_at'], 0.0)
+        return [{'deviceId': device, 'state': state, 'life': int(life), 'bytes': int(intent['bytes'])}
+                for device in intent['path']]
+
+    def intent_stats(self, intents):
+        return {'statistics': [{'id': 1, 'name': 'org.onosproject.ifwd',
+                                'intents': [{intent['key']: self.flow_stats(intent)} for intent in intents]}]}
+
+    def selector(self, intent):
+        src = self.hosts[intent['src_host']]
+        dst = self.hosts[intent['dst_host']]
+        return {'criteria': [
+            {'type': 'ETH_SRC', 'mac': src['mac']},
+            {'type': 'ETH_DST', 'mac': dst['mac']},
+            {'type': 'ETH_TYPE', 'ethType': '0x800'},
+            {'type': 'IPV4_SRC', 'ip': src['ipAddresses'][0] + '/32'},
+            {'type': 'IPV4_DST', 'ip': dst['ipAddresses'][0] + '/32'},
+            {'type': 'IP_PROTO', 'protocol': intent['protocol']},
+            {'type': 'TCP_SRC', 'tcpPort': intent['src_port']},
+            {'type': 'TCP_DST', 'tcpPort': intent['dst_port']},
+        ]}
+
+    def links_load(self):
+        links = []
+        for i, link in enumerate(self.links):
+            load = float(self.link_loads[i])
+            links.append({'src': link['src'], 'dst': link['dst'], 'wire': link['wire'],
+                          'load': int(load), 'rest': int(link['wire'] - load)})
+        return {'links': links}
+
+    # returns (http status, reply object)
+    def handle(self, method, path, body=None):
+        segments = [urllib.parse.unquote(_) for _ in path.split('?', 1)[0].split('/') if _ != '']
+        if segments[:2] == ['onos', 'v1']:
+            segments = segments[2:]
+        with self.lock:
+            self.update_throughput()
+            if method == 'GET':
+                if segments == ['devices']:
+                    return 200, {'devices': [{'id': device, 'type': 'SWITCH', 'available': True}
+                                             for device in self.devices]}
+                if segments == ['hosts']:
+                    return 200, {'hosts': list(self.hosts.values())}
+                if segments == ['intents']:
+                    return 200, {'intents': [{'type': 'HostToHostIntent', 'id': intent['id'], 'key': intent['key'],
+                                              'appId': intent['app'], 'state': 'INSTALLED',
+                                              'resources': [intent['src_host'], intent['dst_host']]}
+                                             for intent in self.intents.values()]}
+                if segments == ['tm', 'tm', 'getLinksLoad']:
+                    return 200, self.links_load()
+                if segments == ['imr', 'imr', 'intentStats']:
+                    return 200, self.intent_stats(self.intents.values())
+                if len(segments) == 4 and segments[:2] == ['intents', 'relatedflows']:
+                    intent = self.intents.get(segments[3])
+                    if intent is None:
+                        return 404, {'paths': []}
+                    return 200, {'paths': [[{'deviceId': intent['path'][0], 'id': intent['id'],
+                                             'selector': self.selector(intent)}]]}
+                if len(segments) == 5 and segments[:2] == ['imrx', 'imrx']:
+                    intent = self.intents.get(segments[4])
+                    if intent is None:
+                        return 404, {}
+                    if segments[2] == 'intentLoad':
+                        return 200, {'load': int(self.throughput.get(intent['key'], 0))}
+                    if segments[2] == 'intentStatsNew':
+                        return 200, self.intent_stats([intent])
+            elif method == 'POST':
+                msg = json.loads(body.decode('utf-8')) if body else {}
+                if segments == ['imrx', 'imrx', 'startMonitorIntent']:
+                    if msg.get('intentKey') not in self.intents:
+                        return 200, {'result': 'Failed'}
+                    return 200, {'result': 'OK'}
+                if segments == ['imrx', 'imrx', 'reRouteIntents']:
+                    results = [self.reroute(routing) for routing in msg.get('routingList', [])]
+                    return 200, {'result': 'OK' if all(results) else 'Failed'}
+        return 404, {}
+
+
+# in-process backend: same interface as OnosClient, no sockets, sleeping advances the virtual clock
+class SimulatorClient(OnosClient):
+    def __init__(self, simulator=None):
+        OnosClient.__init__(self)
+        self.simulator = simulator if simulator is not None else OnosSimulator()
+
+    def exchange(self, method, url, body=None, extra_headers=None):
+        path = urllib.parse.urlsplit(url).path
+        start = time.time()
+        status, reply = self.simulator.handle(method, path, body)
+        self.record(endpoint_name(path), time.time() - start, error=status >= 400)
+        return status, '', {}, json.dumps(reply).encode('utf-8')
+
+    async def exchange_async(self, method, url, body=None, extra_headers=None):
+        return self.exchange(method, url, body, extra_headers)
+
+    def time(self):
+        return self.simulator.clock()
+
+    def sleep(self, delay):
+        if isinstance(self.simulator.clock, VirtualClock):
+            self.simulator.clock.advance(delay)
+        else:
+            time.sleep(delay)
+
+    async def sleep_async(self, delay):
+        if isinstance(self.simulator.clock, VirtualClock):
+            await self.simulator.clock.sleep_async(delay)
+        else:
+            await asyncio.sleep(delay)
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, do not let Nagle hold the body back
+    disable_nagle_algorithm = True
+    simulator = None
+
+    def reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length > 0 else None
+        status, reply = self.simulator.handle(self.command, self.path, body)
+        data = json.dumps(reply).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = reply
+    do_POST = reply
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+# local HTTP stand-in, runs on wall clock time
+def serve(simulator=None, host='127.0.0.1', port=ONOS_PORT):
+    if simulator is None:
+        simulator = OnosSimulator(clock=time.time)
+    handler = type('Handler', (SimulatorHandler,), {'simulator': simulator})
+    server = ThreadingHTTPServer((host, port), handler)
+    logging.info("ONOS simulator listening on %s:%d" % (host, port))
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a simulated ONOS REST API')
+    parser.add_argument('--topology', default=SIM_TOPOLOGY)
+    parser.add_argument('--intents', type=int, default=SIM_INTENTS)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=ONOS_PORT)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s')
+    serve(OnosSimulator(args.topology, args.intents, seed=args.seed, clock=time.time),
+          args.host, args.port).serve_forever()
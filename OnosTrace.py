@@ -0,0 +1,138 @@
+import asyncio
+import gzip
+import json
+import threading
+import time
+import urllib.parse
+from collections import deque
+from config import *
+from OnosClient import OnosClient, endpoint_name
+from OnosSimulator import VirtualClock
+
+
+# REST traffic trace: gzip json lines, one per exchange
+#   t: start offset in s, d: latency in s, m, u (path and query), b: request body,
+#   s, r, h: status, reason and lower case headers of the response, data: response body
+def trace_key(method, url, body):
+    split = urllib.parse.urlsplit(url)
+    path = split.path + ('?' + split.query if split.query else '')
+    return method, path, body.decode('utf-8') if isinstance(body, bytes) else body
+
+
+# forwards every exchange to the wrapped client and appends it to the trace
+class RecordingClient(OnosClient):
+    def __init__(self, client=None, path=ONOS_TRACE):
+        OnosClient.__init__(self)
+        self.client = client if client is not None else OnosClient()
+        self.path = path
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.file_lock = threading.Lock()
+        self.start = time.time()
+
+    def write(self, method, url, body, start, response):
+        status, reason, headers, data = response
+        method, path, body = trace_key(method, url, body)
+        line = json.dumps({'t': round(start - self.start, 6), 'd': round(time.time() - start, 6), 'm': method,
+                           'u': path, 'b': body, 's': status, 'r': reason, 'h': headers,
+                           'data': data.decode('utf-8')}, separators=(',', ':'))
+        with self.file_lock:
+            self.file.write(line + '\n')
+            # sync flush: every written line can be decompressed even if the run is killed before close
+            self.file.flush()
+
+    def exchange(self, method, url, body=None, extra_headers=None):
+        start = time.time()
+        response = self.client.exchange(method, url, body, extra_headers)
+        self.write(method, url, body, start, response)
+        return response
+
+    async def exchange_async(self, method, url, body=None, extra_headers=None):
+        start = time.time()
+        response = await self.client.exchange_async(method, url, body, extra_headers)
+        self.write(method, url, body, start, response)
+        return response
+
+    def time(self):
+        return self.client.time()
+
+    def sleep(self, delay):
+        self.client.sleep(delay)
+
+    async def sleep_async(self, delay):
+        await self.client.sleep_async(delay)
+
+    def latency_stats(self):
+        return self.client.latency_stats()
+
+    def reset_stats(self):
+        self.client.reset_stats()
+
+    def close(self):
+        with self.file_lock:
+            self.file.close()
+        self.client.close()
+
+
+# serves a recorded trace: every (method, path, body) gets its recorded responses in order, the last one is
+# repeated once they run out. Fast replay answers at once on a virtual clock, paced replay waits the recorded
+# latency and sleeps for real
+class ReplayClient(OnosClient):
+    def __init__(self, path=ONOS_TRACE, paced=ONOS_REPLAY_PACED):
+        OnosClient.__init__(self)
+        self.paced = paced
+        self.clock = VirtualClock()
+        self.queues = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            try:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line cut by a crash
+                        break
+                    self.queues.setdefault((entry['m'], entry['u'], entry['b']), deque()).append(entry)
+            except EOFError:
+                # a recording that was not closed has no gzip end of stream
+                pass
+
+    def next_entry(self, method, url, body):
+        with self.lock:
+            queue = self.queues.get(trace_key(method, url, body))
+            if not queue:
+                return None
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def response(self, method, url, entry):
+        endpoint = endpoint_name(urllib.parse.urlsplit(url).path)
+        if entry is None:
+            self.record(endpoint, 0.0, error=True)
+            return 404, 'Not in trace', {}, b'{}'
+        self.record(endpoint, entry['d'], error=entry['s'] >= 400)
+        return entry['s'], entry['r'], entry['h'], entry['data'].encode('utf-8')
+
+    def exchange(self, method, url, body=None, extra_headers=None):
+        entry = self.next_entry(method, url, body)
+        if entry is not None:
+            self.sleep(entry['d'])
+        return self.response(method, url, entry)
+
+    async def exchange_async(self, method, url, body=None, extra_headers=None):
+        entry = self.next_entry(method, url, body)
+        if entry is not None:
+            await self.sleep_async(entry['d'])
+        return self.response(method, url, entry)
+
+    def time(self):
+        return time.time() if self.paced else self.clock()
+
+    def sleep(self, delay):
+        if self.paced:
+            time.sleep(delay)
+        else:
+            self.clock.advance(delay)
+
+    async def sleep_async(self, delay):
+        if self.paced:
+            await asyncio.sleep(delay)
+        else:
+            await self.clock.sleep_async(delay)
@@ -0,0 +1,282 @@
+import hashlib
+import zlib
+import numpy as np
+
+ZLIB_LEVEL = 1
+
+
+# ring of transitions kept in separate preallocated s, a, r, s_ arrays;
+# transitions are written in batches and sampled into output buffers reused across calls
+class ReplayMemory(object):
+    def __init__(self, capacity, s_dim, a_dim, batch_size, dtype=np.float32):
+        self.capacity = capacity
+        self.s_dim = s_dim
+        self.a_dim = a_dim
+        self.batch_size = batch_size
+        self.s = np.zeros((capacity, s_dim), dtype=dtype)
+        self.a = np.zeros((capacity, a_dim), dtype=dtype)
+        self.r = np.zeros((capacity, 1), dtype=dtype)
+        self.s_ = np.zeros((capacity, s_dim), dtype=dtype)
+        # transitions stored so far, the next one goes to pointer % capacity
+        self.pointer = 0
+        self.batch_s = np.zeros((batch_size, s_dim), dtype=dtype)
+        self.batch_a = np.zeros((batch_size, a_dim), dtype=dtype)
+        self.batch_r = np.zeros((batch_size, 1), dtype=dtype)
+        self.batch_s_ = np.zeros((batch_size, s_dim), dtype=dtype)
+        # importance sampling weights of the batch, uniform sampling needs no correction
+        self.weights = np.ones((batch_size, 1), dtype=dtype)
+
+    def __len__(self):
+        return min(self.pointer, self.capacity)
+
+    def store(self, s, a, r, s_):
+        return self.store_batch(s, a, r, s_)[0]
+
+    # n transitions in one write: a is (n, a_dim), s, r and s_ are per transition or shared by all of them
+    # (all nodes of a path have the same s, r and s_); returns the indexes written
+    def store_batch(self, s, a, r, s_):
+        a = np.asarray(a).reshape(-1, self.a_dim)
+        indices = (self.pointer + np.arange(len(a))) % self.capacity
+        self.s[indices] = s
+        self.a[indices] = a
+        self.r[indices] = np.reshape(r, (-1, 1))
+        self.s_[indices] = s_
+        self.pointer += len(a)
+        return indices
+
+    # uniform batch over the stored transitions; the returned arrays are overwritten by the next call
+    def sample(self, rng=np.random):
+        return self.batch(rng.randint(len(self), size=self.batch_size))
+
+    def batch(self, indices):
+        np.take(self.s, indices, axis=0, out=self.batch_s)
+        np.take(self.a, indices, axis=0, out=self.batch_a)
+        np.take(self.r, indices, axis=0, out=self.batch_r)
+        np.take(self.s_, indices, axis=0, out=self.batch_s_)
+        return indices, self.batch_s, self.batch_a, self.batch_r, self.batch_s_
+
+    def update_priorities(self, indices, td_errors):
+        pass
+
+
+# same interface as ReplayMemory for states made of a small per transition head and a large network snapshot
+# (the traffic part, s[head_dim:]) shared by many transitions: all nodes of a path have the same s and s_,
+# and s_ of a step often matches s of the next one. Each distinct snapshot is kept once, reference counted by
+# the transitions using it, as float32, float16 (scaled by its peak to stay in range) or zlib compressed bytes.
+# Sampled batches are rebuilt into the reused output buffers
+class SnapshotReplayMemory(object):
+    def __init__(self, capacity, s_dim, a_dim, batch_size, head_dim, snapshot_dtype=np.float32, compress=False,
+                 dtype=np.float32):
+        self.capacity = capacity
+        self.s_dim = s_dim
+        self.a_dim = a_dim
+        self.batch_size = batch_size
+        self.head_dim = head_dim
+        self.snapshot_dim = s_dim - head_dim
+        self.snapshot_dtype = np.dtype(snapshot_dtype)
+        self.compress = compress
+        self.s = np.zeros((capacity, head_dim), dtype=dtype)
+        self.a = np.zeros((capacity, a_dim), dtype=dtype)
+        self.r = np.zeros((capacity, 1), dtype=dtype)
+        self.s_ = np.zeros((capacity, head_dim), dtype=dtype)
+        # snapshot ids of s and s_, -1 for empty slots
+        self.sid = np.full(capacity, -1, dtype=int)
+        self.sid_ = np.full(capacity, -1, dtype=int)
+        self.pointer = 0
+        # snapshot slots grow on demand, freed ones are reused
+        self.snapshots = [] if compress else np.zeros((0, self.snapshot_dim), dtype=self.snapshot_dtype)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.refcounts = np.zeros(0, dtype=int)
+        self.free_slots = []
+        self.digests = {}
+        self.slot_digests = []
+        self.batch_s = np.zeros((batch_size, s_dim), dtype=dtype)
+        self.batch_a = np.zeros((batch_size, a_dim), dtype=dtype)
+        self.batch_r = np.zeros((batch_size, 1), dtype=dtype)
+        self.batch_s_ = np.zeros((batch_size, s_dim), dtype=dtype)
+        # importance sampling weights of the batch, uniform sampling needs no correction
+        self.weights = np.ones((batch_size, 1), dtype=dtype)
+
+    def __len__(self):
+        return min(self.pointer, self.capacity)
+
+    def snapshot_count(self):
+        return len(self.digests)
+
+    def encode(self, snapshot):
+        scale = 1.0
+        if self.snapshot_dtype == np.float16:
+            peak = np.abs(snapshot).max()
+            scale = peak if peak > 0 else 1.0
+        data = (snapshot / scale).astype(self.snapshot_dtype)
+        return (zlib.compress(data.tobytes(), ZLIB_LEVEL) if self.compress else data), scale
+
+    def decode(self, slot):
+        if self.compress:
+            data = np.frombuffer(zlib.decompress(self.snapshots[slot]), dtype=self.snapshot_dtype)
+        else:
+            data = self.snapshots[slot]
+        return data * self.scales[slot]
+
+    def grow(self):
+        size = max(16, 2 * len(self.refcounts))
+        added = size - len(self.refcounts)
+        if self.compress:
+            self.snapshots.extend([None] * added)
+        else:
+            self.snapshots = np.concatenate((self.snapshots, np.zeros((added, self.snapshot_dim),
+                                                                       dtype=self.snapshot_dtype)))
+        self.scales = np.concatenate((self.scales, np.ones(added, dtype=np.float32)))
+        self.refcounts = np.concatenate((self.refcounts, np.zeros(added, dtype=int)))
+        self.slot_digests.extend([None] * added)
+        self.free_slots.extend(range(size - 1, len(self.refcounts) - added - 1, -1))
+
+    # slot of an identical snapshot or a new one, with count more references
+    def intern(self, snapshot, count):
+        snapshot = np.ascontiguousarray(snapshot, dtype=np.float32)
+        digest = hashlib.blake2b(snapshot.tobytes(), digest_size=16).digest()
+        slot = self.digests.get(digest)
+        if slot is None:
+            if not self.free_slots:
+                self.grow()
+            slot = self.free_slots.pop()
+            self.snapshots[slot], self.scales[slot] = self.encode(snapshot)
+            self.digests[digest] = slot
+            self.slot_digests[slot] = digest
+        self.refcounts[slot] += count
+        return slot
+
+    def release(self, slots):
+        slots = slots[slots >= 0]
+        np.subtract.at(self.refcounts, slots, 1)
+        for slot in np.unique(slots):
+            if self.refcounts[slot] == 0:
+                del self.digests[self.slot_digests[slot]]
+                self.slot_digests[slot] = None
+                if self.compress:
+                    self.snapshots[slot] = None
+                self.free_slots.append(slot)
+
+    def store(self, s, a, r, s_):
+        return self.store_batch(s, a, r, s_)[0]
+
+    # s and s_ are shared by all transitions of the batch
+    def store_batch(self, s, a, r, s_):
+        a = np.asarray(a).reshape(-1, self.a_dim)
+        indices = (self.pointer + np.arange(len(a))) % self.capacity
+        # drop the references of the overwritten transitions
+        self.release(np.concatenate((self.sid[indices], self.sid_[indices])))
+        self.s[indices] = s[:self.head_dim]
+        self.a[indices] = a
+        self.r[indices] = np.reshape(r, (-1, 1))
+        self.s_[indices] = s_[:self.head_dim]
+        self.sid[indices] = self.intern(s[self.head_dim:], len(indices))
+        self.sid_[indices] = self.intern(s_[self.head_dim:], len(indices))
+        self.pointer += len(a)
+        return indices
+
+    def gather_snapshots(self, slots, out):
+        if self.compress:
+            # decompress each distinct snapshot of the batch once
+            unique, inverse = np.unique(slots, return_inverse=True)
+            out[...] = np.stack([self.decode(slot) for slot in unique])[inverse]
+        else:
+            np.multiply(self.snapshots[slots], self.scales[slots, np.newaxis], out=out)
+
+    def sample(self, rng=np.random):
+        return self.batch(rng.randint(len(self), size=self.batch_size))
+
+    def batch(self, indices):
+        np.take(self.s, indices, axis=0, out=self.batch_s[:, :self.head_dim])
+        np.take(self.a, indices, axis=0, out=self.batch_a)
+        np.take(self.r, indices, axis=0, out=self.batch_r)
+        np.take(self.s_, indices, axis=0, out=self.batch_s_[:, :self.head_dim])
+        self.gather_snapshots(self.sid[indices], self.batch_s[:, self.head_dim:])
+        self.gather_snapshots(self.sid_[indices], self.batch_s_[:, self.head_dim:])
+        return indices, self.batch_s, self.batch_a, self.batch_r, self.batch_s_
+
+    def update_priorities(self, indices, td_errors):
+        pass
+
+
+# binary tree of priority sums over a power of two number of leaves, node i has children 2i and 2i + 1,
+# the root is node 1 and leaf j is node size + j; updates and sampling are vectorized over a batch
+class SumTree(object):
+    def __init__(self, capacity):
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.depth = self.size.bit_length() - 1
+        self.nodes = np.zeros(2 * self.size)
+
+    def total(self):
+        return self.nodes[1]
+
+    def get(self, leaves):
+        return self.nodes[self.size + np.asarray(leaves)]
+
+    def update(self, leaves, priorities):
+        nodes = self.size + np.asarray(leaves)
+        self.nodes[nodes] = priorities
+        for level in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    # leaves holding the given points of the cumulative priority
+    def find(self, targets):
+        targets = np.array(targets, dtype=float)
+        nodes = np.ones(len(targets), dtype=int)
+        for level in range(self.depth):
+            nodes *= 2
+            right = targets > self.nodes[nodes]
+            targets -= np.where(right, self.nodes[nodes], 0.0)
+            nodes += right
+        return nodes - self.size
+
+
+# prioritized replay (proportional variant) over a ReplayMemory or SnapshotReplayMemory: transitions are
+# sampled with probability p^alpha / sum p^alpha, p = |TD error| + epsilon, new ones get the highest priority
+# seen so far. Importance sampling weights (N P)^-beta / max, with beta annealed to 1, correct the bias
+class PrioritizedReplay(object):
+    def __init__(self, memory, alpha=0.6, beta=0.4, beta_increment=0.001, epsilon=0.01):
+        self.memory = memory
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.tree = SumTree(memory.capacity)
+        self.max_priority = 1.0
+        self.weights = np.ones_like(memory.weights)
+
+    def __len__(self):
+        return len(self.memory)
+
+    @property
+    def pointer(self):
+        return self.memory.pointer
+
+    def store(self, s, a, r, s_):
+        return self.store_batch(s, a, r, s_)[0]
+
+    def store_batch(self, s, a, r, s_):
+        indices = self.memory.store_batch(s, a, r, s_)
+        self.tree.update(indices, self.max_priority)
+        return indices
+
+    # one point in each of batch_size equal segments of the total priority
+    def sample(self, rng=np.random):
+        batch_size = self.memory.batch_size
+        segment = self.tree.total() / batch_size
+        targets = (np.arange(batch_size) + rng.random_sample(batch_size)) * segment
+        # round off can run past the last stored leaf
+        indices = np.minimum(self.tree.find(targets), len(self) - 1)
+        probabilities = self.tree.get(indices) / self.tree.total()
+        weights = (len(self) * probabilities) ** -self.beta
+        self.weights[:, 0] = weights / weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return self.memory.batch(indices)
+
+    def update_priorities(self, indices, td_errors):
+        priorities = (np.abs(np.ravel(td_errors)) + self.epsilon) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
@@ -1,14 +1,130 @@
 from config import *
-from utils import json_get_req
+from OnosClient import get_client
 from pprint import pprint
 import logging
+import time
+import warnings
+import numpy as np
 from utils import bps_to_human_string
+from TrafficLog import TrafficLog
+
+TM_LOG = 'TrafficMatrix'
+
+
+# fixed capacity ring of traffic matrices, one row per polling round and one column per flow (NaN = no bitrate).
+# Every row is written twice, at p and p + capacity, so the last k <= capacity rows are always one contiguous view
+class TrafficMatrixStore(object):
+    def __init__(self, capacity=TM_STORE_CAPACITY, max_flows=TM_STORE_MAX_FLOWS, idle_rounds=TM_FLOW_IDLE_ROUNDS):
+        self.capacity = capacity
+        self.max_flows = max_flows
+        self.idle_rounds = idle_rounds
+        self.data = np.full((2 * capacity, max_flows), np.nan, dtype=np.float32)
+        self.times = np.full(2 * capacity, np.nan)
+        self.rounds = 0
+        # flow id -> column and back
+        self.flow_index = {}
+        self.column_flow = [None] * max_flows
+        self.free_columns = list(range(max_flows - 1, -1, -1))
+        self.last_seen = np.full(max_flows, -1, dtype=int)
+
+    def __len__(self):
+        return min(self.rounds, self.capacity)
+
+    # column of the flow, -1 when the store is full
+    def column(self, flow_id):
+        column = self.flow_index.get(flow_id)
+        if column is None:
+            if not self.free_columns:
+                return -1
+            column = self.free_columns.pop()
+            # forget the history of the flow that used this column before
+            self.data[:, column] = np.nan
+            self.flow_index[flow_id] = column
+            self.column_flow[column] = flow_id
+        return column
+
+    # columns of the given flows, -1 for the flows that do not fit
+    def columns(self, flow_ids):
+        columns = np.fromiter((self.column(flow_id) for flow_id in flow_ids), dtype=int)
+        dropped = np.count_nonzero(columns < 0)
+        if dropped:
+            logging.warning("Traffic matrix store full, dropping %d flows" % dropped)
+        return columns
+
+    # tm: flow id -> bitrate of this round, seen: all flows present in this round; returns the expired flow ids
+    def append(self, tm, seen=(), timestamp=None):
+        expired = self.append_row(self.columns(tm.keys()), list(tm.values()), self.columns(seen), timestamp)
+        return [flow_id for column, flow_id in expired]
+
+    # bitrates of this round by column, returns the expired (column, flow id) pairs
+    def append_row(self, columns, values, seen=(), timestamp=None):
+        columns = np.asarray(columns, dtype=int)
+        values = np.asarray(values, dtype=np.float32)
+        seen = np.asarray(seen, dtype=int)
+        row = np.full(self.max_flows, np.nan, dtype=np.float32)
+        row[columns[columns >= 0]] = values[columns >= 0]
+        self.last_seen[seen[seen >= 0]] = self.rounds
+        self.last_seen[columns[columns >= 0]] = self.rounds
+        position = self.rounds % self.capacity
+        self.data[position] = row
+        self.data[position + self.capacity] = row
+        self.times[position] = self.times[position + self.capacity] = time.time() if timestamp is None else timestamp
+        self.rounds += 1
+        return self.expire()
+
+    def expire(self):
+        expired = []
+        idle = np.nonzero((self.last_seen >= 0) & (self.rounds - 1 - self.last_seen > self.idle_rounds))[0]
+        for column in idle:
+            flow_id = self.column_flow[column]
+            del self.flow_index[flow_id]
+            self.column_flow[column] = None
+            self.last_seen[column] = -1
+            self.free_columns.append(column)
+            expired.append((column, flow_id))
+        return expired
+
+    def window(self, k=None):
+        k = len(self) if k is None else min(k, len(self))
+        end = (self.rounds - 1) % self.capacity + self.capacity + 1
+        return slice(end - k, end)
+
+    # views of the last k matrices (k, max_flows) and their poll times, no copy
+    def last(self, k=None):
+        return self.data[self.window(k)]
+
+    def last_times(self, k=None):
+        return self.times[self.window(k)]
+
+    def training_set(self):
+        return self.last(TM_TRAINING_SET_SIZE)
+
+    # per flow statistics over the last k matrices, NaN for flows without samples
+    def mean(self, k=None):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(self.last(k), axis=0)
+
+    def percentile(self, q, k=None):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanpercentile(self.last(k), q, axis=0)
+
+    def flows(self):
+        return dict(self.flow_index)
 
 
 class StatsManager(object):
-    def __init__(self, verbose=VERBOSE):
-        self.last_stat = {}
-        self.tm_store = []
+    def __init__(self, verbose=VERBOSE, client=None, folder=None):
+        self.client = client if client is not None else get_client()
+        self.tm_store = TrafficMatrixStore()
+        # every stored matrix is also appended to the run folder log, columns labelled by flow id
+        self.tm_log = None
+        if folder is not None and TRAFFIC_LOG:
+            self.tm_log = TrafficLog(folder + TM_LOG, self.tm_store.max_flows)
+        # bytes and life of the last stat of each flow, aligned with the store columns (NaN = no stat yet)
+        self.last_bytes = np.full(self.tm_store.max_flows, np.nan)
+        self.last_life = np.full(self.tm_store.max_flows, np.nan)
         self.verbose = verbose
 
     @staticmethod
@@ -17,9 +133,35 @@ class StatsManager(object):
         delta_time = current_stat['life'] - old_stat['life']
         return 1.0 * 8 * delta_bytes / delta_time if delta_time > 0 and delta_bytes >= 0 else None
 
+    # same as bitrate on aligned arrays, NaN where there is no previous stat or the guards fail
+    @staticmethod
+    def bitrates(old_bytes, old_life, current_bytes, current_life):
+        delta_bytes = current_bytes - old_bytes
+        delta_time = current_life - old_life
+        valid = (delta_time > 0) & (delta_bytes >= 0)
+        return np.divide(8.0 * delta_bytes, delta_time, out=np.full(len(valid), np.nan), where=valid)
+
+    # flatten a polling round into one entry per flow stat: flow ids (by code), codes, bytes and life arrays
+    @staticmethod
+    def flatten(stat_list):
+        flow_ids = {}
+        codes = []
+        stat_bytes = []
+        life = []
+        for app_stat in stat_list:
+            for intents in app_stat['intents']:
+                for intentKey, stats in intents.items():
+                    if not stats:
+                        continue
+                    code = flow_ids.setdefault((intentKey, app_stat['id'], app_stat['name']), len(flow_ids))
+                    codes.extend([code] * len(stats))
+                    stat_bytes.extend(stat['bytes'] for stat in stats)
+                    life.extend(stat['life'] for stat in stats)
+        return list(flow_ids), np.array(codes, dtype=int), np.array(stat_bytes, dtype=float), \
+            np.array(life, dtype=float)
+
     def add_stats(self, stat_list):
-        tm = {}
-        filtered_stats = {}
+        flow_ids, codes, stat_bytes, life = self.flatten(stat_list)
 
         # For a same flow we might receive many flow stats (possibly one for each switch) with different "life" values:
         # in some cases the differences are due to potential ONOS asynchrony in receiving stats event from a given
@@ -27,33 +169,46 @@ class StatsManager(object):
         # might be added as brand new with a 0-valued life).
         # Currently we are keeping the with biggest "life" value: in case of coexsistence of old+new rules this means
         # keeping the oldest, in case of all new rules this means the most updated.
-        for app_stat in stat_list:
-            for intents in app_stat['intents']:
-                for intentKey, stats in intents.items():
-                    for stat in stats:
-                        flow_id = (intentKey, app_stat['id'], app_stat['name'])
-                        if flow_id not in filtered_stats or \
-                                (flow_id in filtered_stats and stat['life'] > filtered_stats[flow_id]['life']):
-                            filtered_stats[flow_id] = stat
-
-        # For each flow we check if a stat related to a previous polling round is available
-        for flow_id, stat in filtered_stats.items():
-            if flow_id in self.last_stat:
-                bitrate = self.bitrate(self.last_stat[flow_id], stat)
-                if bitrate is not None:
-                    tm[flow_id] = bitrate
-            self.last_stat[flow_id] = stat
-
-        self.tm_store.append(tm)
+        # Sorted by flow then life then reversed arrival, the last entry of each flow is the first stat with the
+        # biggest life
+        order = np.lexsort((-np.arange(len(codes)), life, codes))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = codes[order][1:] != codes[order][:-1]
+        keep = order[last]
+        stat_bytes = stat_bytes[keep]
+        life = life[keep]
+
+        # align with the stats of the previous polling rounds through the store columns
+        columns = self.tm_store.columns(flow_ids)
+        stored = columns >= 0
+        rates = np.full(len(columns), np.nan)
+        rates[stored] = self.bitrates(self.last_bytes[columns[stored]], self.last_life[columns[stored]],
+                                      stat_bytes[stored], life[stored])
+        self.last_bytes[columns[stored]] = stat_bytes[stored]
+        self.last_life[columns[stored]] = life[stored]
+
+        # flows missing for more than TM_FLOW_IDLE_ROUNDS rounds free their column and their last stat
+        measured = ~np.isnan(rates)
+        expired = self.tm_store.append_row(columns[measured], rates[measured], columns, self.client.time())
+        for column, flow_id in expired:
+            self.last_bytes[column] = self.last_life[column] = np.nan
+        if self.tm_log is not None:
+            labels = {int(columns[i]): list(flow_ids[i]) for i in np.nonzero(stored)[0]}
+            self.tm_log.append(self.tm_store.last_times(1)[0], self.tm_store.last(1)[0], labels)
         if self.verbose:
-            pprint({flow_id: bps_to_human_string(tm[flow_id]) for flow_id in tm})
+            pprint({flow_ids[i]: bps_to_human_string(rates[i]) for i in np.nonzero(measured)[0]})
 
     def poll_stats(self):
         logging.info("Polling Traffic Matrices...")
-        reply = json_get_req('http://%s:%d/onos/v1/imr/imr/intentStats' % (ONOS_IP, ONOS_PORT))
+        reply = self.client.get_json('http://%s:%d/onos/v1/imr/imr/intentStats' % (ONOS_IP, ONOS_PORT))
         if 'statistics' not in reply:
             return
         self.add_stats(reply['statistics'])
 
     def get_tm_store(self):
         return self.tm_store
+
+    def close(self):
+        if self.tm_log is not None:
+            self.tm_log.close()
+            self.tm_log = None
@@ -0,0 +1,143 @@
+import json
+import os
+import numpy as np
+from config import *
+
+
+# fixed width record: poll time and one float32 value per column
+def record_dtype(width):
+    return np.dtype([('time', '<f8'), ('values', '<f4', (width,))])
+
+
+# sparse time index entry: time of every index_stride-th record
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('record', '<i8')])
+
+
+# append-only binary log of a series of traffic vectors, stored as three files:
+#   <path>.bin   the records, memory-mapped by TrafficLogReader without parsing
+#   <path>.idx   (time, record) of every index_stride-th record for time-range lookups
+#   <path>.json  json lines, the record width then the column labels from the record they apply to
+class TrafficLog(object):
+    def __init__(self, path, width, index_stride=TRAFFIC_LOG_INDEX_STRIDE):
+        self.path = path
+        self.width = width
+        self.index_stride = index_stride
+        self.record = np.zeros(1, dtype=record_dtype(width))
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.records = 0
+        resume = os.path.exists(path + '.json')
+        if resume:
+            self.resume()
+        # without a labels file any .bin and .idx left over belong to no log, start them again
+        self.data_file = open(path + '.bin', 'ab' if resume else 'wb')
+        self.index_file = open(path + '.idx', 'ab' if resume else 'wb')
+        self.labels_file = open(path + '.json', 'a')
+        if not resume:
+            self.write_labels({'width': width})
+        self.labels = {}
+
+    # cut the three files back to the last complete record, a crash can tear the last write of each of them
+    def resume(self):
+        with open(self.path + '.json') as file:
+            lines = file.read().split('\n')
+        if json.loads(lines[0])['width'] != self.width:
+            raise ValueError("Traffic log %s has another record width" % self.path)
+        if os.path.exists(self.path + '.bin'):
+            self.records = os.path.getsize(self.path + '.bin') // self.record.itemsize
+            os.truncate(self.path + '.bin', self.records * self.record.itemsize)
+        if os.path.exists(self.path + '.idx'):
+            with open(self.path + '.idx', 'rb') as file:
+                data = file.read()
+            index = np.frombuffer(data[:len(data) - len(data) % INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE)
+            # entries are in record order, keep those of the records left
+            kept = int(np.searchsorted(index['record'], self.records))
+            os.truncate(self.path + '.idx', kept * INDEX_DTYPE.itemsize)
+        # label changes of the dropped records and a torn last line go, the kept lines are rewritten whole
+        kept_lines = lines[:1]
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if entry['record'] >= self.records:
+                break
+            kept_lines.append(line)
+        if kept_lines != [line for line in lines if line]:
+            with open(self.path + '.json', 'w') as file:
+                file.write(''.join(line + '\n' for line in kept_lines))
+
+    def write_labels(self, entry):
+        self.labels_file.write(json.dumps(entry) + '\n')
+        self.labels_file.flush()
+
+    # labels: column -> json serializable label, only the columns that changed meaning are written
+    def append(self, timestamp, values, labels=None):
+        if labels:
+            changed = {column: label for column, label in labels.items() if self.labels.get(column) != label}
+            if changed:
+                self.labels.update(changed)
+                self.write_labels({'record': self.records, 'labels': changed})
+        self.record['time'] = timestamp
+        self.record['values'] = values
+        self.data_file.write(self.record.tobytes())
+        self.data_file.flush()
+        if self.records % self.index_stride == 0:
+            self.index_file.write(np.array([(timestamp, self.records)], dtype=INDEX_DTYPE).tobytes())
+            self.index_file.flush()
+        self.records += 1
+
+    def close(self):
+        for file in (self.data_file, self.index_file, self.labels_file):
+            file.close()
+
+
+# zero copy reader of a TrafficLog, times and values are views of the memory-mapped records
+class TrafficLogReader(object):
+    def __init__(self, path):
+        with open(path + '.json') as file:
+            entries = [json.loads(line) for line in file if line.strip()]
+        self.width = entries[0]['width']
+        self.label_changes = entries[1:]
+        dtype = record_dtype(self.width)
+        count = os.path.getsize(path + '.bin') // dtype.itemsize
+        if count > 0:
+            self.data = np.memmap(path + '.bin', dtype=dtype, mode='r', shape=(count,))
+        else:
+            self.data = np.zeros(0, dtype=dtype)
+        index = np.fromfile(path + '.idx', dtype=INDEX_DTYPE)
+        self.index = index[index['record'] < count]
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def times(self):
+        return self.data['time']
+
+    @property
+    def values(self):
+        return self.data['values']
+
+    # first record with time >= timestamp: bisect the sparse index, then the records of one stride
+    def search(self, timestamp):
+        i = np.searchsorted(self.index['time'], timestamp, side='left')
+        low = self.index['record'][i - 1] if i > 0 else 0
+        high = self.index['record'][i] if i < len(self.index) else len(self)
+        return int(low + np.searchsorted(self.data['time'][low:high], timestamp, side='left'))
+
+    # records with start <= time < end
+    def between(self, start=None, end=None):
+        low = 0 if start is None else self.search(start)
+        high = len(self) if end is None else self.search(end)
+        return self.data[low:high]
+
+    # column -> label in effect at the given record (the last one by default)
+    def labels(self, record=None):
+        labels = {}
+        for entry in self.label_changes:
+            if record is not None and entry['record'] > record:
+                break
+            labels.update({int(column): label for column, label in entry['labels'].items()})
+        return labels
@@ -2,13 +2,68 @@ ONOS_IP = "192.168.3.51"
 ONOS_PORT = 8181
 ONOS_USER = "onos"
 ONOS_PASS = "rocks"
+# "onos" for a live controller, "simulator" for the in-process OnosSimulator,
+# "record" a live controller into ONOS_TRACE, "replay" ONOS_TRACE without a controller
+ONOS_BACKEND = "onos"
+ONOS_TIMEOUT = 10
+ONOS_RETRIES = 2
+ONOS_POOL_SIZE = 4
 FOLDER = "runs/"
+# REST trace of the record and replay backends, replayed at the recorded latencies when paced
+ONOS_TRACE = FOLDER + "onos_trace.jsonl.gz"
+ONOS_REPLAY_PACED = False
 DEFAULT_ACCESS_CAPACITY = 10000000000
+# "inprocess" uses Embedding.EmbeddingEngine, "openne" runs the OpenNE script at EMBEDDING_TOOL_DIR
+EMBEDDING_BACKEND = "inprocess"
 EMBEDDING_TOOL_DIR = "/home/vm/workspace/OpenNE/src/main.py"
+# "deepWalk" or "spectral" (in process), any OpenNE method with the openne backend
 EMBEDDING_METHOD = "deepWalk"
 REPESENTATTION_SIZE = 30
 EMBEDDING_WORKERS = 2
 EMBEDDING_WINDOWS_SIZE = 4
+EMBEDDING_WALK_LENGTH = 80
+EMBEDDING_NUM_WALKS = 10
+# subspace iterations when embeddings are updated after a link change
+EMBEDDING_UPDATE_ITERATIONS = 3
+# embeddings cached by topology hash under FOLDER, least recently used evicted above the byte limit
+EMBEDDING_CACHE = True
+EMBEDDING_CACHE_DIR = FOLDER + "embeddings/"
+EMBEDDING_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# poll link loads every POLLING_INTERVAL seconds on a background thread
+MONITOR_BACKGROUND = False
 POLLING_INTERVAL = 5
+# OnosSimulator: topology (a saved getLinksLoad reply), number of intents, demand range in bps, flow install time in s
+SIM_TOPOLOGY = "linkload.json"
+SIM_INTENTS = 10
+SIM_DEMAND = (100000000, 1000000000)
+SIM_INSTALL_DELAY = 0.5
+# flow installation polling: first interval, backoff factor, cap and overall timeout in seconds
+FLOW_POLL_INTERVAL = 0.1
+FLOW_POLL_BACKOFF = 2
+FLOW_POLL_MAX_INTERVAL = 2
+FLOW_INSTALL_TIMEOUT = 10
+# intent throughput is settled when the last SETTLE_WINDOW samples have std/mean below SETTLE_THRESHOLD
+SETTLE_WINDOW = 5
+SETTLE_INTERVAL = 1
+SETTLE_THRESHOLD = 0.05
+SETTLE_TIMEOUT = 60
+# intents tracked and rerouted together by MultiIntentONOSEnv
+MULTI_INTENTS = 4
+# ddpg.py: env worker processes feeding one learner (0 trains in a single loop), learner updates between
+# actor weight broadcasts, rows of the shared transition queue
+ACTOR_WORKERS = 0
+WEIGHT_SYNC_INTERVAL = 100
+TRANSITION_QUEUE_CAPACITY = 4096
 TM_TRAINING_SET_SIZE = 3
+# StatsManager traffic matrix ring: rounds kept, flow columns, rounds before an absent flow is forgotten
+TM_STORE_CAPACITY = 1024
+TM_STORE_MAX_FLOWS = 1024
+TM_FLOW_IDLE_ROUNDS = 10
+# binary traffic matrix and link load logs in each run folder, time index entry every TRAFFIC_LOG_INDEX_STRIDE records
+TRAFFIC_LOG = False
+TRAFFIC_LOG_INDEX_STRIDE = 256
+# network part of the state: "dense" flattened N x N load matrix, "links" one load per link in a fixed order
+STATE_LAYOUT = "dense"
+# with the links layout also add load / capacity per link
+STATE_LINK_UTILIZATION = False
 VERBOSE = True
@@ -16,11 +16,14 @@ gym 0.8.0
 
 import tensorflow as tf
 import numpy as np
-import random as random
 from Environment import ONOSEnv
-from utils import setup_exp, setup_run
+from ReplayMemory import ReplayMemory, SnapshotReplayMemory, PrioritizedReplay
+from Actor import PathPolicy
+from ActorLearner import train_parallel
+from utils import setup_exp, setup_run, setup_client
 from config import *
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 #####################  hyper parameters  ####################
 
@@ -32,6 +35,21 @@ GAMMA = 0.9     # reward discount
 TAU = 0.01      # soft replacement
 MEMORY_CAPACITY = 10000
 BATCH_SIZE = 32
+# keep each distinct traffic part of s / s_ once in the replay memory, as float32 or float16, optionally zlib compressed
+REPLAY_DEDUP = False
+REPLAY_SNAPSHOT_DTYPE = np.float32
+REPLAY_COMPRESS = False
+# sample transitions by TD error (sum-tree), alpha: prioritization, beta: importance sampling correction
+PRIORITIZED_REPLAY = False
+PER_ALPHA = 0.6
+PER_BETA = 0.4
+PER_BETA_INCREMENT = 0.001
+PER_EPSILON = 0.01
+# run env.step on a thread and keep learning while it waits for flows and loads, at most LEARN_UPDATES_PER_SECOND
+LEARN_WHILE_WAITING = False
+LEARN_UPDATES_PER_SECOND = 50
+# each learn() feeds LEARN_BLOCK_UPDATES sampled batches at once and runs that many updates on them in graph
+LEARN_BLOCK_UPDATES = 1
 
 RENDER = False
 ENV_NAME = 'Pendulum-v0'
@@ -40,64 +58,150 @@ ENV_NAME = 'Pendulum-v0'
 ###############################  DDPG  ####################################
 
 
-class DDPG(object):
-    def __init__(self, a_dim, s_dim, a_bound,):
+class DDPG(PathPolicy):
+    def __init__(self, a_dim, s_dim, a_bound, head_dim=None):
 
-        self.memory = np.zeros((MEMORY_CAPACITY, s_dim * 2 + a_dim + 1), dtype=np.float32)
-        self.pointer = 0
+        # head_dim: size of the state before its traffic part
+        if REPLAY_DEDUP and head_dim is not None:
+            self.memory = SnapshotReplayMemory(MEMORY_CAPACITY, s_dim, a_dim, BATCH_SIZE, head_dim,
+                                               REPLAY_SNAPSHOT_DTYPE, REPLAY_COMPRESS)
+        else:
+            self.memory = ReplayMemory(MEMORY_CAPACITY, s_dim, a_dim, BATCH_SIZE)
+        if PRIORITIZED_REPLAY:
+            self.memory = PrioritizedReplay(self.memory, PER_ALPHA, PER_BETA, PER_BETA_INCREMENT, PER_EPSILON)
 
         self.sess = tf.Session()
 
         self.a_dim, self.s_dim, self.a_bound = a_dim, s_dim, a_bound,
 
-        self.S = tf.placeholder(tf.float32, [None, s_dim], 's')
-        self.S_ = tf.placeholder(tf.float32, [None, s_dim], 's_')
-        self.R = tf.placeholder(tf.float32, [None, 1], 'r')
+        if LEARN_BLOCK_UPDATES > 1:
+            # batches default to slices of a block staged in graph, feeding them still works
+            self.S, self.A, self.R, self.S_, self.ISW = self._build_block(LEARN_BLOCK_UPDATES * BATCH_SIZE)
+        else:
+            self.S = tf.placeholder(tf.float32, [None, s_dim], 's')
+            self.A = tf.placeholder(tf.float32, [None, a_dim], 'a')
+            self.R = tf.placeholder(tf.float32, [None, 1], 'r')
+            self.S_ = tf.placeholder(tf.float32, [None, s_dim], 's_')
+            # importance sampling weights of the replayed batch
+            self.ISW = tf.placeholder(tf.float32, [None, 1], 'is_weights')
 
         self.a = self._build_a(self.S,)
         q = self._build_c(self.S, self.a, )
+        # critic on the replayed actions, so both updates run in one session call
+        q_replayed = self._build_c(self.S, self.A, reuse=True)
 
-        a_params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='Actor')
+        a_params = self.a_params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='Actor')
         c_params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='Critic')
 
+        a_loss = - tf.reduce_mean(q)  # maximize the q
+        self.atrain = tf.train.AdamOptimizer(LR_A).minimize(a_loss, var_list=a_params)
+
         ema = tf.train.ExponentialMovingAverage(decay=1 - TAU)          # soft replacement
 
         def ema_getter(getter, name, *args, **kwargs):
             return ema.average(getter(name, *args, **kwargs))
 
-        target_update = [ema.apply(a_params), ema.apply(c_params)]      # soft update operation
+        # actor step, soft update, critic step: the order of the former separate atrain and ctrain calls
+        with tf.control_dependencies([self.atrain]):
+            target_update = [ema.apply(a_params), ema.apply(c_params)]      # soft update operation
         a_ = self._build_a(self.S_, reuse=True, custom_getter=ema_getter)   # replaced target parameters
         q_ = self._build_c(self.S_, a_, reuse=True, custom_getter=ema_getter)
 
-        a_loss = - tf.reduce_mean(q)  # maximize the q
-        self.atrain = tf.train.AdamOptimizer(LR_A).minimize(a_loss, var_list=a_params)
-
         with tf.control_dependencies(target_update):    # soft replacement happened at here
             q_target = self.R + GAMMA * q_
-            td_error = tf.losses.mean_squared_error(labels=q_target, predictions=q)
+            self.abs_td_error = tf.abs(q_target - q_replayed)
+            td_error = tf.losses.mean_squared_error(labels=q_target, predictions=q_replayed, weights=self.ISW)
             self.ctrain = tf.train.AdamOptimizer(LR_C).minimize(td_error, var_list=c_params)
 
+        self.train = tf.group(self.atrain, self.ctrain)
+        if LEARN_BLOCK_UPDATES > 1:
+            with tf.control_dependencies([self.train]):
+                self.train = self.block_step.assign_add(1)
+
         self.sess.run(tf.global_variables_initializer())
 
+    # s, a, r, s_, is_weights inputs reading batch block_step of a block of size rows loaded by load_block
+    def _build_block(self, size):
+        names = ['s', 'a', 'r', 's_', 'is_weights']
+        widths = [self.s_dim, self.a_dim, 1, self.s_dim, 1]
+        self.block_host = [np.zeros((size, width), dtype=np.float32) for width in widths]
+        with tf.variable_scope('Block'):
+            block = [tf.Variable(tf.zeros([size, width]), trainable=False, name=name)
+                     for name, width in zip(names, widths)]
+            self.block_feed = [tf.placeholder(tf.float32, [size, width], name) for name, width in zip(names, widths)]
+            self.block_step = tf.Variable(0, trainable=False, name='step')
+            self.load_block = tf.group(*[variable.assign(feed) for variable, feed in zip(block, self.block_feed)]
+                                       + [self.block_step.assign(0)])
+            start = self.block_step * BATCH_SIZE
+            batches = [tf.slice(variable, [start, 0], [BATCH_SIZE, -1]) for variable in block]
+        return [tf.placeholder_with_default(batch, [None, width], name)
+                for batch, name, width in zip(batches, names, widths)]
+
     def choose_action(self, s):
         return self.sess.run(self.a, {self.S: s[np.newaxis, :]})[0]
 
-    def learn(self):
-        indices = np.random.choice(MEMORY_CAPACITY, size=BATCH_SIZE)
-        bt = self.memory[indices, :]
-        bs = bt[:, :self.s_dim]
-        ba = bt[:, self.s_dim: self.s_dim + self.a_dim]
-        br = bt[:, -self.s_dim - 1: -self.s_dim]
-        bs_ = bt[:, -self.s_dim:]
+    # one forward pass for a batch of states (K, s_dim)
+    def choose_actions(self, S):
+        return self.sess.run(self.a, {self.S: S})
 
-        self.sess.run(self.atrain, {self.S: bs})
-        self.sess.run(self.ctrain, {self.S: bs, self.a: ba, self.R: br, self.S_: bs_})
+    @property
+    def pointer(self):
+        return self.memory.pointer
+
+    # [l1 kernel, l1 bias, a kernel, a bias] as numpy arrays, see Actor.NumpyActor
+    def actor_weights(self):
+        return self.sess.run(self.a_params)
+
+    def learn(self):
+        if LEARN_BLOCK_UPDATES > 1:
+            return self.learn_block()
+        indices, bs, ba, br, bs_ = self.memory.sample()
+
+        abs_td_error, _ = self.sess.run([self.abs_td_error, self.train], {self.S: bs, self.A: ba, self.R: br,
+                                                                           self.S_: bs_, self.ISW: self.memory.weights})
+        self.memory.update_priorities(indices, abs_td_error)
+
+    # LEARN_BLOCK_UPDATES batches sampled up front and transferred in one call, then one call per update
+    # with nothing fed
+    def learn_block(self):
+        all_indices = []
+        for i in range(LEARN_BLOCK_UPDATES):
+            indices, bs, ba, br, bs_ = self.memory.sample()
+            rows = slice(i * BATCH_SIZE, (i + 1) * BATCH_SIZE)
+            for target, source in zip(self.block_host, (bs, ba, br, bs_, self.memory.weights)):
+                target[rows] = source
+            all_indices.append(np.array(indices))
+        self.sess.run(self.load_block, dict(zip(self.block_feed, self.block_host)))
+        for indices in all_indices:
+            abs_td_error, _ = self.sess.run([self.abs_td_error, self.train])
+            self.memory.update_priorities(indices, abs_td_error)
+
+    # learn until future (a pending env.step) is done, paced to updates_per_second (0: no limit),
+    # nothing before learn_start transitions are stored; returns the number of updates
+    def learn_until(self, future, learn_start, updates_per_second=LEARN_UPDATES_PER_SECOND):
+        updates = 0
+        interval = 1.0 / updates_per_second if updates_per_second > 0 else 0.0
+        next_update = time.time()
+        while not future.done():
+            if self.pointer <= learn_start:
+                wait([future])
+                break
+            now = time.time()
+            if now < next_update:
+                wait([future], timeout=next_update - now)
+                continue
+            self.learn()
+            updates += 1
+            # do not burst to catch up after a slow update
+            next_update = max(next_update + interval, now)
+        return updates
 
     def store_transition(self, s, a, r, s_):
-        transition = np.hstack((s, a, [r], s_))
-        index = self.pointer % MEMORY_CAPACITY  # replace the old memory with new memory
-        self.memory[index, :] = transition
-        self.pointer += 1
+        return self.memory.store(s, a, r, s_)
+
+    # one transition per row of a, sharing s, r and s_
+    def store_batch(self, s, a, r, s_):
+        return self.memory.store_batch(s, a, r, s_)
 
     def _build_a(self, s, reuse=None, custom_getter=None):
         trainable = True if reuse is None else False
@@ -116,112 +220,66 @@ class DDPG(object):
             net = tf.nn.relu(tf.matmul(s, w1_s) + tf.matmul(a, w1_a) + b1)
             return tf.layers.dense(net, 1, trainable=trainable)  # Q(s,a)
 
-    # epsilon : control exploration
-    # s为一个状态，也即将routeArgs中的 currentPosition变为节点embedding的表示，同时需要考虑 networkState
-    def get_path(self, env, epsilon=0.1):
-        # 存储最后的路径列表
-        path = []
-
-        # origin_express array index
-        origin_express = env.initial_route_args[-1]
-
-        step_mix_s = env.now_s
-        now_traffic = env.now_traffic
-
-        # 添加第一个节点
-        path.append(origin_express)
-
-        # use for avoid repeat node
-        visited = dict()
-        visited[origin_express] = origin_express
-
-        # 最多产生 MAX_EP_STEPS 个节点的路径
-        for j in range(MAX_PATH_STEPS):
-            current_position = origin_express
-            # currentPosition 的邻居节点，这个列表是节点的编号(array index)
-            neighbor_nodes = env.get_node_neighbors(current_position)
-
-            # if current_position is neighbor of dst
-            if env.is_dst_neighbor(current_position):
-                path.append(env.tracked_intent['dst_index'])
-                return path
-
-            if np.random.rand() > epsilon:  # add randomness to action selection for exploration
-                # choose best action
-                # here replace with s
-                action = ddpg.choose_action(step_mix_s)
-
-                # 比较点action和 neighborNode节点的距离，以及neighborNode和目的节点的距离，需要折中，返回一个节点
-                origin_express = env.compare_node(action, neighbor_nodes)  # compareNode函数返回具体的节点编号
-
-            else:
-                # choose random action
-                if len(neighbor_nodes) > 1:
-                    origin_express = random.sample(neighbor_nodes, 1)[0]  # 从currentPosition的邻居节点 随机选择一个
-
-            path.append(origin_express)
-
-            # repeat point return path
-            if visited.get(origin_express) is not None:
-                return path
-            else:
-                visited[origin_express] = origin_express
-
-            # change route_args current_position->origin_express embedding
-            embeddinged_route_args = env.get_embeddinged_route_args(origin_express)
-
-            step_mix_s = np.append(embeddinged_route_args, now_traffic)
-
-        return path
-
-        # 如果选择的点有环路，则环境会返回来一个reward，reward的值，应该很小，表示不想出现环路
-        # 2：如果即将加入的originExpress的所有邻居，已经都在path中，则需要在path中删除后三个，重新设置 originExpress
-
-
-#  env  setup #
-setup_exp()
-folder = setup_run()
-env = ONOSEnv(folder)
-#  training  #
-
-s_dim = len(env.initial_route_args) -1 + REPESENTATTION_SIZE + len(env.env_loads.flatten())
-a_dim = REPESENTATTION_SIZE
-a_bound = 1
-MAX_PATH_STEPS = env.active_nodes
-MAX_EP_STEPS = 1000
-ddpg = DDPG(a_dim, s_dim, a_bound)
-# ddpg.train(routeTuple) # 路径元祖，是一个list：【（vector1，vector2）（vector1，vector2）】，vector是Embedding之后的表示
-
-t1 = time.time()
-for i in range(MAX_EPISODES):
-    ep_reward = 0
-    # 流量矩阵
-    # s = env.reset()  # 环境初始化
-    for j in range(MAX_EP_STEPS):
-        # reset to get load traffic and s = embeddinged_route_args + traffic
-        env.reset()
-        s = env.now_s
-        path = ddpg.get_path(env)
-
-        # ===选择完了动作之后在环境中执行动作===
-        # when path can not find r =-1, s_ is now load
-        s_, r = env.step(path)  # 在环境中执行动作，获取吞吐量信息，s_是执行这个动作之后，网络的状态，可以用流量矩阵，压缩成一个多维数组
-
-        if r > 0:
-            for element in path:
-                ddpg.store_transition(s, env.node_embeddinged[element], r, s_)  # 存储每一步所选择的动作，也就是路径中点的表示
-        else:# only punish last one
-            ddpg.store_transition(s, env.node_embeddinged[path[len(path)-1]], r, s_)
-
-        if ddpg.pointer > MEMORY_CAPACITY:
-            # var *= .9995    # decay the action randomness
-            ddpg.learn()
-
-        s = s_
-        ep_reward += r
-        if j == MAX_EP_STEPS - 1:
-            print('Episode:', i, ' Reward: %i' % int(ep_reward), )
-            # if ep_reward > -300:RENDER = True
-            break
-
-print('Running time: ', time.time() - t1)
\ No newline at end of file
+
+if __name__ == '__main__':
+    #  env  setup #
+    setup_exp()
+    folder = setup_run()
+    client = setup_client()
+    env = ONOSEnv(folder)
+    #  training  #
+
+    s_dim = env.state_dim
+    a_dim = REPESENTATTION_SIZE
+    a_bound = 1
+    MAX_EP_STEPS = 1000
+    ddpg = DDPG(a_dim, s_dim, a_bound, head_dim=s_dim - env.state_builder.traffic.size)
+    # ddpg.train(routeTuple) # 路径元祖，是一个list：【（vector1，vector2）（vector1，vector2）】，vector是Embedding之后的表示
+
+    if ACTOR_WORKERS > 0:
+        t1 = time.time()
+        updates = train_parallel(ddpg, folder, s_dim, a_dim, ACTOR_WORKERS, MAX_EPISODES * MAX_EP_STEPS // ACTOR_WORKERS,
+                                 MEMORY_CAPACITY, env.node_embeddinged)
+        print('Learner updates: ', updates)
+        print('Running time: ', time.time() - t1)
+    else:
+        stepper = ThreadPoolExecutor(max_workers=1) if LEARN_WHILE_WAITING else None
+        t1 = time.time()
+        for i in range(MAX_EPISODES):
+            ep_reward = 0
+            # 流量矩阵
+            # s = env.reset()  # 环境初始化
+            for j in range(MAX_EP_STEPS):
+                # reset to get load traffic and s = embeddinged_route_args + traffic
+                env.reset()
+                s = env.now_s
+                path = ddpg.get_path(env)
+
+                # ===选择完了动作之后在环境中执行动作===
+                # when path can not find r =-1, s_ is now load
+                if stepper is not None:
+                    future = stepper.submit(env.step, path)
+                    ddpg.learn_until(future, MEMORY_CAPACITY)
+                    s_, r = future.result()
+                else:
+                    s_, r = env.step(path)  # 在环境中执行动作，获取吞吐量信息，s_是执行这个动作之后，网络的状态，可以用流量矩阵，压缩成一个多维数组
+
+                if r > 0:
+                    ddpg.store_batch(s, env.node_embeddinged[path], r, s_)  # 存储每一步所选择的动作，也就是路径中点的表示
+                else:# only punish last one
+                    ddpg.store_transition(s, env.node_embeddinged[path[len(path)-1]], r, s_)
+
+                if ddpg.pointer > MEMORY_CAPACITY:
+                    # var *= .9995    # decay the action randomness
+                    ddpg.learn()
+
+                s = s_
+                ep_reward += r
+                if j == MAX_EP_STEPS - 1:
+                    print('Episode:', i, ' Reward: %i' % int(ep_reward), )
+                    # if ep_reward > -300:RENDER = True
+                    break
+
+        print('Running time: ', time.time() - t1)
+    env.close()
+    client.close()
\ No newline at end of file
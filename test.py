@@ -1,12 +1,17 @@
 ﻿from Environment import ONOSEnv
-from utils import setup_exp, setup_run
+from utils import setup_exp, setup_run, setup_client
 import time
 
 if __name__ == "__main__":
     setup_exp()
     folder = setup_run()
+    client = setup_client()
     env = ONOSEnv(folder)
     time.sleep(10)
-    while True:
-        time.sleep(5)
-        env.update_intent_load()
+    try:
+        while True:
+            time.sleep(5)
+            env.update_intent_load()
+    finally:
+        env.close()
+        client.close()
@@ -1,12 +1,11 @@
-import base64
 import logging
-import urllib.request
+import urllib.parse
 import numpy as np
 import os
-import json
 import time
 from shutil import copyfile
 from config import *
+from OnosClient import get_client, set_client
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s')
 
@@ -15,37 +14,29 @@ def url_quote(data):
     return urllib.parse.quote(data).replace("/", "%2F")
 
 
-def authenticated_http_req(url, user, pwd):
-    request = urllib.request.Request(url)
-    # print(url)
-    payload = '%s:%s' % (user, pwd)
-    base64string = base64.b64encode(payload.encode('utf-8')).decode("utf-8")
-    request.add_header('Authorization', 'Basic %s' % base64string)
-    return request
-
-
 def json_get_req(url):
-    try:
-        request = authenticated_http_req(url, ONOS_USER, ONOS_PASS)
-        response = urllib.request.urlopen(request)
-        return json.loads(response.read().decode("utf-8"))
-    except IOError as e:
-        logging.error(e)
-        return ''
+    return get_client().get_json(url)
 
 
 def json_post_req(url, json_data):
-    try:
-        request = authenticated_http_req(url, ONOS_USER, ONOS_PASS)
-        request.add_header('Content-Type', 'application/json')
-        # json to bytes
-        data = bytes(json_data, encoding='utf-8')
-        # print(data)
-        response = urllib.request.urlopen(request, data=data)
-        return json.loads(response.read().decode("utf-8"))
-    except IOError as e:
-        logging.error(e)
-        return ''
+    return get_client().post_json(url, json_data)
+
+
+# install the client shared by ONOSEnv and StatsManager, trace is the file of the record and replay backends
+def setup_client(backend=ONOS_BACKEND, trace=ONOS_TRACE):
+    if backend == 'simulator':
+        from OnosSimulator import SimulatorClient
+        set_client(SimulatorClient())
+    elif backend == 'record':
+        from OnosTrace import RecordingClient
+        os.makedirs(os.path.dirname(trace) or '.', exist_ok=True)
+        set_client(RecordingClient(path=trace))
+    elif backend == 'replay':
+        from OnosTrace import ReplayClient
+        set_client(ReplayClient(path=trace))
+    elif backend != 'onos':
+        raise ValueError("Unknown ONOS backend: %s" % backend)
+    return get_client()
 
 
 def bps_to_human_string(value, to_byte_per_second=False):
@@ -69,6 +60,18 @@ def scale(array):
     return np.asarray((array - mean)/std)
 
 
+# coefficient of variation of a window of load samples below threshold, NaN samples (failed reads) are skipped
+def is_stable(samples, threshold):
+    samples = np.asarray(samples, dtype=float)
+    samples = samples[~np.isnan(samples)]
+    if len(samples) == 0:
+        return False
+    mean = samples.mean()
+    if mean <= 0:
+        return samples.std() == 0
+    return samples.std() / mean <= threshold
+
+
 def softmax(x):
     return np.exp(x) / np.sum(np.exp(x), axis=0)
 